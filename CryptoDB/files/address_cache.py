@@ -0,0 +1,46 @@
+import dbm
+import os
+import threading
+from collections import OrderedDict
+
+
+class AddressCache:
+    # Contract/EOA classification of addresses: in-process LRU plus an optional on-disk dbm store.
+    # Only contracts are stored on disk: an EOA can get code later (counterfactual wallets funded
+    # before their factory deploys them), so EOA answers live in the LRU and are asked again after
+    # a restart or eviction.
+
+    def __init__(self, name, size, directory=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.known_addresses = dbm.open(os.path.join(directory, f'known_addresses_{name}'), 'c') if directory else None
+
+    def get(self, address):
+        # True - contract, False - EOA, None - not classified yet
+        with self.lock:
+            if address in self.entries:
+                self.entries.move_to_end(address)
+                return self.entries[address]
+
+            # Files written before EOAs were kept out of them still hold b'0' entries, which are ignored
+            if self.known_addresses is not None and self.known_addresses.get(address) == b'1':
+                self._remember(address, True)
+                return True
+        return None
+
+    def put(self, address, contract):
+        with self.lock:
+            self._remember(address, contract)
+            if contract and self.known_addresses is not None:
+                self.known_addresses[address] = b'1'
+
+    def _remember(self, address, contract):
+        self.entries[address] = contract
+        self.entries.move_to_end(address)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        if self.known_addresses is not None:
+            self.known_addresses.close()
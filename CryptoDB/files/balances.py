@@ -0,0 +1,59 @@
+import os
+
+import rpc
+
+try:
+    from eth_abi import decode, encode
+except ImportError:  # eth-abi < 4, as pinned by web3 5
+    from eth_abi import decode_abi as decode, encode_abi as encode
+
+# Multicall3 is deployed at the same address on every chain in chains.py
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+AGGREGATE3 = bytes.fromhex("82ad56cb")       # aggregate3((address,bool,bytes)[])
+GET_ETH_BALANCE = bytes.fromhex("4d2301cc")  # getEthBalance(address)
+BALANCE_OF = bytes.fromhex("70a08231")       # balanceOf(address)
+
+# Sub-calls per aggregate3 eth_call; nodes cap the gas of an eth_call, and one balance read costs
+# a few thousand gas
+MAX_MULTICALL_CALLS = int(os.getenv("MULTICALL_MAX_CALLS", 500))
+
+
+def address_call(selector, address):
+    return selector + encode(['address'], [address])
+
+
+def aggregate3_call(calls, block="latest"):
+    # eth_call params for one aggregate3 over [(target, calldata)], every sub-call allowed to fail
+    data = AGGREGATE3 + encode(['(address,bool,bytes)[]'], [[(target, True, calldata) for target, calldata in calls]])
+    return [{"to": MULTICALL3_ADDRESS, "data": "0x" + data.hex()}, block if block == "latest" else hex(block)]
+
+
+def get_balances(url, contracts, tokens, block="latest"):
+    # Native balance and balanceOf of every token for every contract at block, read through
+    # Multicall3 eth_calls sent together in JSON-RPC batches. Returns {contract: (native wei,
+    # {token: raw balance, or None when balanceOf failed})}.
+    calls = []
+    keys = []
+    for contract in contracts:
+        calls.append((MULTICALL3_ADDRESS, address_call(GET_ETH_BALANCE, contract)))
+        keys.append((contract, None))
+        for token in tokens:
+            calls.append((token, address_call(BALANCE_OF, contract)))
+            keys.append((contract, token))
+
+    multicalls = [aggregate3_call(calls[i:i + MAX_MULTICALL_CALLS], block) for i in range(0, len(calls), MAX_MULTICALL_CALLS)]
+    results = []
+    for i in range(0, len(multicalls), rpc.MAX_BATCH_CALLS):
+        replies = rpc.rpc_batch(url, [("eth_call", params) for params in multicalls[i:i + rpc.MAX_BATCH_CALLS]])
+        for reply in replies:
+            results += decode(['(bool,bytes)[]'], bytes.fromhex(reply[2:]))[0]
+
+    balances = {contract: (0, {}) for contract in contracts}
+    for (contract, token), (success, data) in zip(keys, results):
+        value = int.from_bytes(data[:32], 'big') if success and len(data) >= 32 else None
+        if token is None:
+            balances[contract] = (value or 0, balances[contract][1])
+        else:
+            balances[contract][1][token] = value
+    return balances
@@ -0,0 +1,171 @@
+import os
+
+# Per-chain settings of the contract scanner and the enricher. A new chain is a new entry here.
+CHAINS = {
+    'eth': {
+        'rpc_url': os.getenv("INFURA_URL_ETH"),
+        'table': 'contract_addresses_eth',
+        'log_file': '/root/files/info_log_eth.txt',
+        'block_file': '/root/files/last_blocks/last_processed_block_eth.txt',
+        'backfill_file': '/root/files/last_blocks/backfill_chunks_eth.txt',
+        'block_batch_size': int(os.getenv("BLOCK_BATCH_SIZE_ETH", 20)),
+        'max_concurrency': int(os.getenv("MAX_CONCURRENCY_ETH", 2)),
+        # 'interaction' - recipients of transactions, 'creation' - deployments from receipts, 'both'
+        'detection': os.getenv("DETECTION_ETH", 'both'),
+        # eth_getBlockReceipts for 'creation' detection, which then skips the transaction bodies
+        'block_receipts': os.getenv("BLOCK_RECEIPTS_ETH", 'true') == 'true',
+        # Fetch tx hashes first and hydrate only blocks with more than system_txs transactions.
+        # On L2s every block carries system_txs protocol transactions even when nothing else happens.
+        # It costs one more request per batch and only saves bytes when many blocks are empty, so it
+        # stays off until the skip rate logged by the scanner shows it pays off on a chain.
+        'prefilter': os.getenv("PREFILTER_ETH", 'false') == 'true',
+        'system_txs': 0,
+        'backfill_chunk_size': int(os.getenv("BACKFILL_CHUNK_SIZE_ETH", 10000)),
+        'backfill_workers': int(os.getenv("BACKFILL_WORKERS_ETH", 4)),
+        # Optional Transfer log indexer (transfer_index.py): tracked token balances of known contracts
+        # follow the chain from eth_getLogs over ranges of log_range_size blocks, confirmations behind the head.
+        # Ranges are sized to stay under the usual 10000-log cap; larger answers are split in halves.
+        'transfer_index': os.getenv("TRANSFER_INDEX_ETH", 'false') == 'true',
+        'log_range_size': int(os.getenv("LOG_RANGE_SIZE_ETH", 20)),
+        'confirmations': 12,
+
+        # Enrichment (process_contracts.py)
+        'label': 'ETH',
+        'enrich_log_file': '/root/files/contract_info_log_eth.txt',
+        # Balance refresh (refresh_balances.py)
+        'refresh_log_file': '/root/files/refresh_log_eth.txt',
+        # created_at checkpoint of the enricher before the work queue, read once to seed the queue
+        'last_checked_file': '/root/files/last_checked_time_eth.txt',
+        'etherscan_url': 'https://api.etherscan.io/api',
+        'etherscan_api_key': os.getenv("ETHERSCAN_API"),
+        'covalent_api_key': os.getenv("COVALENTHQ_ETH_API"),
+        'covalent_chain': 'eth-mainnet',
+        'coingecko_platform': 'ethereum',
+        'native_symbol': 'ETH',
+        # Tracked token whose price values the native balance (balance refresh tiers)
+        'wrapped_native': '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2',
+        'price_chunk_size': 7,  # Maximum of addresses per one CoinGecko request
+        # ERC-20 tokens whose balances are read with Multicall3: (address, symbol, decimals)
+        'tracked_tokens': [
+            ('0xdAC17F958D2ee523a2206206994597C13D831ec7', 'USDT', 6),
+            ('0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48', 'USDC', 6),
+            ('0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2', 'WETH', 18),
+            ('0x6B175474E89094C44Da98b954EedeAC495271d0F', 'DAI', 18),
+            ('0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599', 'WBTC', 8),
+        ],
+    },
+    'bsc': {
+        'rpc_url': os.getenv("BSC_RPC_NODE", "https://bsc-dataseed1.ninicoin.io/"),
+        'table': 'contract_addresses_bsc',
+        'log_file': '/root/files/bsc/info_log_bsc.txt',
+        'block_file': '/root/files/last_blocks/last_processed_block_bsc.txt',
+        'backfill_file': '/root/files/last_blocks/backfill_chunks_bsc.txt',
+        'block_batch_size': int(os.getenv("BLOCK_BATCH_SIZE_BSC", 50)),
+        'max_concurrency': int(os.getenv("MAX_CONCURRENCY_BSC", 4)),
+        'detection': os.getenv("DETECTION_BSC", 'both'),
+        'block_receipts': os.getenv("BLOCK_RECEIPTS_BSC", 'false') == 'true',
+        'prefilter': os.getenv("PREFILTER_BSC", 'false') == 'true',
+        'system_txs': 0,
+        'backfill_chunk_size': int(os.getenv("BACKFILL_CHUNK_SIZE_BSC", 20000)),
+        'backfill_workers': int(os.getenv("BACKFILL_WORKERS_BSC", 4)),
+        'transfer_index': os.getenv("TRANSFER_INDEX_BSC", 'false') == 'true',
+        'log_range_size': int(os.getenv("LOG_RANGE_SIZE_BSC", 20)),
+        'confirmations': 15,
+
+        'label': 'BSC',
+        'enrich_log_file': '/root/files/bsc/contract_info_log_bsc.txt',
+        'refresh_log_file': '/root/files/bsc/refresh_log_bsc.txt',
+        'last_checked_file': '/root/files/bsc/last_checked_time_bsc.txt',
+        'etherscan_url': 'https://api.bscscan.com/api',
+        'etherscan_api_key': os.getenv("ETHERSCAN_BSC_API"),
+        'covalent_api_key': os.getenv("COVALENTHQ_BSC_API"),
+        'covalent_chain': 'bsc-mainnet',
+        'coingecko_platform': 'binance-smart-chain',
+        'native_symbol': 'BNB',
+        'wrapped_native': '0xbb4CdB9CBd36B01bD1cBaEBF2De08d9173bc095c',
+        'price_chunk_size': 7,  # Maximum of addresses per one CoinGecko request
+        'tracked_tokens': [
+            ('0x55d398326f99059fF775485246999027B3197955', 'USDT', 18),
+            ('0x8AC76a51cc950d9822D68b83fE1Ad97B32Cd580d', 'USDC', 18),
+            ('0xe9e7CEA3DedcA5984780Bafc599bD69ADd087D56', 'BUSD', 18),
+            ('0xbb4CdB9CBd36B01bD1cBaEBF2De08d9173bc095c', 'WBNB', 18),
+            ('0x2170Ed0880ac9A755fd29B2688956BD959F933F8', 'ETH', 18),
+        ],
+    },
+    'arb': {
+        'rpc_url': os.getenv("INFURA_URL_ARB"),
+        'table': 'contract_addresses_arb',
+        'log_file': '/root/files/arb/info_log_arb.txt',
+        'block_file': '/root/files/last_blocks/last_processed_block_arb.txt',
+        'backfill_file': '/root/files/last_blocks/backfill_chunks_arb.txt',
+        'block_batch_size': int(os.getenv("BLOCK_BATCH_SIZE_ARB", 50)),
+        'max_concurrency': int(os.getenv("MAX_CONCURRENCY_ARB", 4)),
+        'detection': os.getenv("DETECTION_ARB", 'both'),
+        'block_receipts': os.getenv("BLOCK_RECEIPTS_ARB", 'true') == 'true',
+        'prefilter': os.getenv("PREFILTER_ARB", 'false') == 'true',
+        'system_txs': 1,
+        'backfill_chunk_size': int(os.getenv("BACKFILL_CHUNK_SIZE_ARB", 50000)),
+        'backfill_workers': int(os.getenv("BACKFILL_WORKERS_ARB", 4)),
+        'transfer_index': os.getenv("TRANSFER_INDEX_ARB", 'false') == 'true',
+        'log_range_size': int(os.getenv("LOG_RANGE_SIZE_ARB", 200)),
+        'confirmations': 20,
+
+        'label': 'ARB',
+        'enrich_log_file': '/root/files/arb/contract_info_log_arb.txt',
+        'refresh_log_file': '/root/files/arb/refresh_log_arb.txt',
+        'last_checked_file': '/root/files/arb/last_checked_time_arb.txt',
+        'etherscan_url': 'https://api.arbiscan.io/api',
+        'etherscan_api_key': os.getenv("ETHERSCAN_ARB_API"),
+        'covalent_api_key': os.getenv("COVALENTHQ_ARB_API"),
+        'covalent_chain': 'arbitrum-mainnet',
+        'coingecko_platform': 'arbitrum-one',
+        'native_symbol': 'ETH',
+        'wrapped_native': '0x82aF49447D8a07e3bd95BD0d56f35241523fBab1',
+        'price_chunk_size': 3,  # Maximum of addresses per one CoinGecko request
+        'tracked_tokens': [
+            ('0xFd086bC7CD5C481DCC9C85ebE478A1C0b69FCbb9', 'USDT', 6),
+            ('0xaf88d065e77c8cC2239327C5EDb3A432268e5831', 'USDC', 6),
+            ('0xFF970A61A04b1cA14834A43f5dE4533eBDDB5CC8', 'USDC.e', 6),
+            ('0x82aF49447D8a07e3bd95BD0d56f35241523fBab1', 'WETH', 18),
+            ('0x912CE59144191C1204E64559FE8253a0e49E6548', 'ARB', 18),
+        ],
+    },
+    'opt': {
+        'rpc_url': os.getenv("INFURA_URL_OPT"),
+        'table': 'contract_addresses_opt',
+        'log_file': '/root/files/opt/info_log_opt.txt',
+        'block_file': '/root/files/last_blocks/last_processed_block_opt.txt',
+        'backfill_file': '/root/files/last_blocks/backfill_chunks_opt.txt',
+        'block_batch_size': int(os.getenv("BLOCK_BATCH_SIZE_OPT", 20)),
+        'max_concurrency': int(os.getenv("MAX_CONCURRENCY_OPT", 2)),
+        'detection': os.getenv("DETECTION_OPT", 'both'),
+        'block_receipts': os.getenv("BLOCK_RECEIPTS_OPT", 'true') == 'true',
+        'prefilter': os.getenv("PREFILTER_OPT", 'false') == 'true',
+        'system_txs': 1,
+        'backfill_chunk_size': int(os.getenv("BACKFILL_CHUNK_SIZE_OPT", 20000)),
+        'backfill_workers': int(os.getenv("BACKFILL_WORKERS_OPT", 4)),
+        'transfer_index': os.getenv("TRANSFER_INDEX_OPT", 'false') == 'true',
+        'log_range_size': int(os.getenv("LOG_RANGE_SIZE_OPT", 100)),
+        'confirmations': 10,
+
+        'label': 'OPT',
+        'enrich_log_file': '/root/files/opt/contract_info_log_opt.txt',
+        'refresh_log_file': '/root/files/opt/refresh_log_opt.txt',
+        'last_checked_file': '/root/files/opt/last_checked_time_opt.txt',
+        'etherscan_url': 'https://api-optimistic.etherscan.io/api',
+        'etherscan_api_key': os.getenv("ETHERSCAN_OPT_API"),
+        'covalent_api_key': os.getenv("COVALENTHQ_OPT_API"),
+        'covalent_chain': 'optimism-mainnet',
+        'coingecko_platform': 'optimistic-ethereum',
+        'native_symbol': 'ETH',
+        'wrapped_native': '0x4200000000000000000000000000000000000006',
+        'price_chunk_size': 3,  # Maximum of addresses per one CoinGecko request
+        'tracked_tokens': [
+            ('0x94b008aA00579c1307B0EF2c499aD98a8ce58e58', 'USDT', 6),
+            ('0x0b2C639c533813f4Aa9D7837CAf62653d097Ff85', 'USDC', 6),
+            ('0x4200000000000000000000000000000000000006', 'WETH', 18),
+            ('0x4200000000000000000000000000000000000042', 'OP', 18),
+            ('0xDA10009cBd5D07dd0CeCc66161FC93D7c9000da1', 'DAI', 18),
+        ],
+    },
+}
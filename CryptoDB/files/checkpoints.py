@@ -0,0 +1,45 @@
+import os
+import threading
+
+
+class ChunkCheckpoint:
+    # Finished block ranges of a backfill, one "start-end" line per chunk, appended as chunks complete
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = []
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    start, _, end = line.strip().partition('-')
+                    if start and end:
+                        self.done.append((int(start), int(end)))
+
+    def covered_ranges(self):
+        merged = []
+        for start, end in sorted(self.done):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def missing_chunks(self, start_block, end_block, chunk_size):
+        # Chunks not covered by finished ranges, so a changed chunk size does not rescan finished work
+        covered = self.covered_ranges()
+        chunks = []
+        for chunk_start in range(start_block, end_block + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_block)
+            if not any(start <= chunk_start and chunk_end <= end for start, end in covered):
+                chunks.append((chunk_start, chunk_end))
+        return chunks
+
+    def mark_done(self, chunk_start, chunk_end):
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(f"{chunk_start}-{chunk_end}\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self.done.append((chunk_start, chunk_end))
@@ -0,0 +1,59 @@
+import asyncio
+
+
+class BatchCoalescer:
+    # Collects the keys many coroutines ask for and resolves them together: a batch is sent once
+    # max_batch distinct keys are waiting or max_wait seconds after the first of them arrived.
+    # resolve is a coroutine function taking a list of keys and returning {key: value}.
+
+    def __init__(self, resolve, max_batch, max_wait):
+        self.resolve = resolve
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = {}
+        self.in_flight = {}
+        self.timer = None
+
+    async def get_many(self, keys):
+        loop = asyncio.get_running_loop()
+        futures = {}
+
+        for key in dict.fromkeys(keys):
+            if key in self.in_flight:
+                futures[key] = self.in_flight[key]
+                continue
+            if key not in self.pending:
+                self.pending[key] = loop.create_future()
+            futures[key] = self.pending[key]
+            if len(self.pending) >= self.max_batch:
+                self.flush()
+
+        if self.pending and self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+
+        values = await asyncio.gather(*futures.values())
+        return dict(zip(futures, values))
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, {}
+        if batch:
+            self.in_flight.update(batch)
+            asyncio.ensure_future(self.send(batch))
+
+    async def send(self, batch):
+        try:
+            values = await self.resolve(list(batch))
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values[key])
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for key in batch:
+                self.in_flight.pop(key, None)
@@ -0,0 +1,65 @@
+import time
+
+import pymysql
+
+from work_queue import ENQUEUE_QUERY
+
+
+class ContractWriter:
+    # Buffers detected contracts and writes them as multi-row INSERT IGNORE statements
+    # (pymysql executemany packs the rows into one VALUES list). A flush commits the rows
+    # and only then runs the on_commit callbacks, so checkpoints never get ahead of the table.
+    # With queue_chain the contracts are pushed to the enrichment queue in the same transaction.
+
+    def __init__(self, connect, table, logger, max_rows, max_seconds, queue_chain=None):
+        self.connect = connect
+        self.insert_query = f"INSERT IGNORE INTO {table} (address) VALUES (%s)"
+        self.queue_chain = queue_chain
+        self.logger = logger
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.connection = connect()
+        self.addresses = {}
+        self.on_commit = []
+        self.last_flush = time.monotonic()
+
+    def add(self, addresses, on_commit=None):
+        self.addresses.update(dict.fromkeys(addresses))
+        if on_commit:
+            self.on_commit.append(on_commit)
+
+        if len(self.addresses) >= self.max_rows or time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.addresses:
+            rows = [(address,) for address in self.addresses]
+            for attempt in range(2):
+                try:
+                    with self.connection.cursor() as cursor:
+                        cursor.executemany(self.insert_query, rows)
+                        if self.queue_chain:
+                            cursor.executemany(ENQUEUE_QUERY, [(self.queue_chain, address) for address in self.addresses])
+                    self.connection.commit()
+                    break
+                except pymysql.err.OperationalError as db_error:
+                    if attempt:
+                        raise
+                    self.logger.error("Database connection error: %s", str(db_error))
+                    self.logger.info("Reconnecting to the database...")
+                    self.connection.close()
+                    self.connection = self.connect()
+                    self.logger.info("Reconnected to the database.")
+
+            for address in self.addresses:
+                self.logger.info("Find a new contract: %s", address)
+
+        for callback in self.on_commit:
+            callback()
+
+        self.addresses = {}
+        self.on_commit = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.connection.close()
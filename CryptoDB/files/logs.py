@@ -0,0 +1,12 @@
+import logging
+
+
+def get_chain_logger(component, name, log_file):
+    # One log file per chain, as with the former per-chain scripts
+    logger = logging.getLogger(f"{component}.{name}")
+    if not logger.handlers:
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    return logger
@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pymysql
+from web3 import Web3
+
+import ratelimit
+import rpc
+from address_cache import AddressCache
+from chains import CHAINS
+from checkpoints import ChunkCheckpoint
+from contract_writer import ContractWriter
+from logs import get_chain_logger
+from schema import ensure_schema
+from transfer_index import TRANSFER_TOPIC, TransferIndexer
+
+db_host = os.getenv("MYSQL_HOST")
+db_user = os.getenv("MYSQL_NAME")
+db_password = os.getenv("MYSQL_PASSWORD")
+db_name = os.getenv("MYSQL_DATABASE")
+
+ADDRESS_CACHE_SIZE = int(os.getenv("ADDRESS_CACHE_SIZE", 500000))
+ADDRESS_CACHE_DIR = os.getenv("ADDRESS_CACHE_DIR")
+
+# Buffered contracts are written once either threshold is reached
+FLUSH_ROWS = int(os.getenv("FLUSH_ROWS", 1000))
+FLUSH_SECONDS = int(os.getenv("FLUSH_SECONDS", 30))
+
+# Pause between catch-up rounds of one chain
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", 86400))
+# Pause between rounds of the Transfer log indexer, which follows the head more closely
+TRANSFER_INDEX_INTERVAL = int(os.getenv("TRANSFER_INDEX_INTERVAL", 60))
+
+
+def connect_to_database():
+    return pymysql.connect(host=db_host, user=db_user, password=db_password, database=db_name)
+
+
+class ChainScanner:
+    def __init__(self, name, config, backfill=False):
+        self.name = name
+        self.config = config
+        self.rpc_url = config['rpc_url']
+        self.logger = get_chain_logger('parse_contracts', name, config['log_file'])
+        # Limits the number of RPC requests in flight for this chain
+        self.semaphore = asyncio.Semaphore(config['max_concurrency'])
+        # A backfill runs next to the live scanner of its chain, and a dbm file takes one writer
+        cache_name = f"{name}_backfill" if backfill else name
+        self.address_cache = AddressCache(cache_name, ADDRESS_CACHE_SIZE, ADDRESS_CACHE_DIR)
+        self.writer = None
+        # Backfill workers share the writer, so writes go through one at a time
+        self.db_lock = asyncio.Lock()
+        self.transfer_indexer = None
+        if config['transfer_index']:
+            self.transfer_indexer = TransferIndexer(connect_to_database, name, config['tracked_tokens'])
+
+    async def call_rpc(self, func, *args):
+        # Runs a blocking rpc helper in a worker thread under the chain's RPC rate limiter
+        async with self.semaphore:
+            return await asyncio.to_thread(ratelimit.call, f"rpc_{self.name}", func, self.rpc_url, *args)
+
+    async def fetch_created_contracts(self, block_numbers, blocks):
+        # Contracts deployed by the transactions of the blocks, taken from receipts. With the bodies
+        # at hand only creation transactions need a receipt; whole-block receipts (with every log)
+        # are worth it only when the bodies are skipped.
+        if blocks:
+            creations = [tx['hash'] for block in blocks for tx in block['transactions'] if tx.get('to') is None]
+            receipts = await self.call_rpc(rpc.get_receipts, creations) if creations else []
+        else:
+            receipts = [receipt for block_receipts in await self.call_rpc(rpc.get_block_receipts, block_numbers)
+                        for receipt in block_receipts]
+
+        created = [receipt for receipt in receipts if receipt and receipt.get('contractAddress')]
+        contracts = {
+            Web3.to_checksum_address(receipt['contractAddress'])
+            for receipt in created if receipt.get('status') == '0x1'
+        }
+
+        # Receipts before Byzantium have no status; a failed creation left no code behind
+        unconfirmed = [Web3.to_checksum_address(receipt['contractAddress'])
+                       for receipt in created if receipt.get('status') is None]
+        if unconfirmed:
+            codes = await self.call_rpc(rpc.get_codes, unconfirmed)
+            contracts |= {address for address, code in zip(unconfirmed, codes) if code and code != '0x'}
+        return contracts
+
+    async def fetch_batch(self, block_numbers):
+        # Returns the contract addresses found in the blocks of the batch
+        detection = self.config['detection']
+
+        if self.config['prefilter']:
+            headers = await self.call_rpc(rpc.get_blocks, block_numbers, False)
+            fetched = len(block_numbers)
+            block_numbers = [
+                number for number, header in zip(block_numbers, headers)
+                if len(header['transactions']) > self.config['system_txs']
+            ]
+            self.logger.info("Prefilter skipped %d of %d blocks", fetched - len(block_numbers), fetched)
+            if not block_numbers:
+                return []
+
+        # Deployments read from block receipts do not need the transaction bodies
+        if detection == 'creation' and self.config['block_receipts']:
+            blocks = []
+        else:
+            blocks = await self.call_rpc(rpc.get_blocks, block_numbers)
+
+        contracts = set()
+        if detection in ('creation', 'both'):
+            contracts = await self.fetch_created_contracts(block_numbers, blocks)
+            for address in contracts:
+                self.address_cache.put(address, True)
+
+        if detection in ('interaction', 'both'):
+            recipients = {
+                Web3.to_checksum_address(tx['to'])
+                for block in blocks for tx in block['transactions'] if tx.get('to')
+            } - contracts
+            classified = {address: self.address_cache.get(address) for address in recipients}
+
+            unknown = [address for address, contract in classified.items() if contract is None]
+            if unknown:
+                codes = await self.call_rpc(rpc.get_codes, unknown)
+                for address, code in zip(unknown, codes):
+                    classified[address] = bool(code) and code != '0x'
+                    self.address_cache.put(address, classified[address])
+
+            contracts |= {address for address, contract in classified.items() if contract}
+
+        return sorted(contracts)
+
+    def save_block_checkpoint(self, block_number):
+        with open(self.config['block_file'], 'w') as file:
+            file.write(str(block_number))
+
+    async def write(self, addresses, on_commit=None):
+        async with self.db_lock:
+            await asyncio.to_thread(self.writer.add, addresses, on_commit)
+
+    async def open_writer(self):
+        self.writer = await asyncio.to_thread(
+            ContractWriter, connect_to_database, self.config['table'], self.logger, FLUSH_ROWS, FLUSH_SECONDS,
+            self.name)
+
+    def close_writer(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    async def scan_range(self, start_block, end_block, save_checkpoint=True):
+        # Fetches up to max_concurrency batches ahead and stores them strictly in block order
+        batch_size = self.config['block_batch_size']
+        pending = deque()
+        next_block = start_block
+
+        try:
+            while pending or next_block <= end_block:
+                while next_block <= end_block and len(pending) < self.config['max_concurrency']:
+                    block_numbers = list(range(next_block, min(next_block + batch_size, end_block + 1)))
+                    pending.append((block_numbers, asyncio.create_task(self.fetch_batch(block_numbers))))
+                    next_block = block_numbers[-1] + 1
+
+                block_numbers, task = pending.popleft()
+                contracts = await task
+                # The block checkpoint moves only when the flush holding these contracts commits
+                await self.write(contracts, partial(self.save_block_checkpoint, block_numbers[-1]) if save_checkpoint else None)
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    def read_checkpoint(self):
+        try:
+            with open(self.config['block_file'], 'r') as file:
+                return int(file.read().strip()) + 1
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def run(self):
+        while True:
+            try:
+                await self.open_writer()
+
+                latest_block_number = await self.call_rpc(rpc.get_block_number)
+                self.logger.info("Last block: %d", latest_block_number)
+
+                start_block = self.read_checkpoint()
+                if start_block is None:
+                    # History before the first run is left to the backfill mode
+                    start_block = latest_block_number
+                    self.logger.info("No checkpoint, starting from block %d. Use --backfill for older blocks.",
+                                     start_block)
+
+                await self.scan_range(start_block, latest_block_number)
+                await asyncio.to_thread(self.writer.flush)
+
+            except Exception as e:
+                self.logger.error("Error: %s", str(e), exc_info=True)
+
+            finally:
+                self.close_writer()
+
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def fetch_transfer_logs(self, tokens, from_block, to_block):
+        # A range over the node's result cap is split in halves until every part fits
+        try:
+            return await self.call_rpc(rpc.get_logs, tokens, [TRANSFER_TOPIC], from_block, to_block)
+        except rpc.TooManyResults:
+            if from_block == to_block:
+                raise
+            middle = (from_block + to_block) // 2
+            return (await self.fetch_transfer_logs(tokens, from_block, middle) +
+                    await self.fetch_transfer_logs(tokens, middle + 1, to_block))
+
+    async def index_transfers(self, end_block):
+        # Applies the Transfer logs of the tracked tokens up to end_block, fetching up to
+        # max_concurrency block ranges ahead and applying them strictly in block order
+        start_block = await asyncio.to_thread(self.transfer_indexer.start, end_block)
+        range_size = self.config['log_range_size']
+        ranges = deque((block, min(block + range_size - 1, end_block))
+                       for block in range(start_block, end_block + 1, range_size))
+        tokens = [address for address, _, _ in self.config['tracked_tokens']]
+        pending = deque()
+
+        try:
+            while pending or ranges:
+                while ranges and len(pending) < self.config['max_concurrency']:
+                    from_block, to_block = ranges.popleft()
+                    task = asyncio.create_task(self.fetch_transfer_logs(tokens, from_block, to_block))
+                    pending.append((from_block, to_block, task))
+
+                from_block, to_block, task = pending.popleft()
+                logs = await task
+                changed = await asyncio.to_thread(self.transfer_indexer.apply, logs, from_block, to_block)
+                if changed:
+                    self.logger.info("Blocks %d-%d: %d indexed balances changed", from_block, to_block, changed)
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+
+    async def run_transfer_index(self):
+        while True:
+            try:
+                latest_block_number = await self.call_rpc(rpc.get_block_number)
+                await self.index_transfers(latest_block_number - self.config['confirmations'])
+            except Exception as e:
+                self.logger.error("Transfer index error: %s", str(e), exc_info=True)
+
+            await asyncio.sleep(TRANSFER_INDEX_INTERVAL)
+
+    async def backfill(self, start_block, end_block):
+        # Scans [start_block, end_block] in chunks on a pool of workers; finished chunks survive restarts
+        checkpoint = ChunkCheckpoint(self.config['backfill_file'])
+        chunks = checkpoint.missing_chunks(start_block, end_block, self.config['backfill_chunk_size'])
+        self.logger.info("Backfill %d-%d: %d chunks to scan", start_block, end_block, len(chunks))
+
+        queue = asyncio.Queue()
+        for chunk in chunks:
+            queue.put_nowait(chunk)
+
+        async def worker():
+            while not queue.empty():
+                chunk_start, chunk_end = queue.get_nowait()
+                await self.scan_range(chunk_start, chunk_end, save_checkpoint=False)
+                await self.write([], partial(checkpoint.mark_done, chunk_start, chunk_end))
+                self.logger.info("Backfill chunk %d-%d scanned, %d left", chunk_start, chunk_end, queue.qsize())
+
+        await self.open_writer()
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.config['backfill_workers'])))
+            await asyncio.to_thread(self.writer.flush)
+        finally:
+            self.close_writer()
+
+
+async def backfill_chain(name, start_block, end_block):
+    config = CHAINS[name]
+    workers = config['max_concurrency'] + config['backfill_workers']
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+
+    await ChainScanner(name, config, backfill=True).backfill(start_block, end_block)
+
+
+async def scan_chains(chain_names):
+    # Every chain needs threads for its RPC requests plus one for database writes, and one more
+    # for the writes of its Transfer log indexer
+    workers = sum(CHAINS[name]['max_concurrency'] + 1 + CHAINS[name]['transfer_index'] for name in chain_names)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+
+    scanners = [ChainScanner(name, CHAINS[name]) for name in chain_names]
+    await asyncio.gather(*(scanner.run() for scanner in scanners),
+                         *(scanner.run_transfer_index() for scanner in scanners if scanner.transfer_indexer))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find contract addresses in the blocks of the configured chains")
+    parser.add_argument('chains', nargs='*', help=f"chains to scan: {', '.join(CHAINS)} (default: every chain with an RPC url)")
+    parser.add_argument('--backfill', nargs=2, type=int, metavar=('START', 'END'),
+                        help="scan the block range START-END of one chain instead of following its head")
+    args = parser.parse_args()
+
+    unknown_chains = set(args.chains) - set(CHAINS)
+    if unknown_chains:
+        parser.error(f"unknown chains: {', '.join(sorted(unknown_chains))}")
+
+    ensure_schema(connect_to_database)
+
+    if args.backfill:
+        if len(args.chains) != 1:
+            parser.error("--backfill needs exactly one chain")
+        asyncio.run(backfill_chain(args.chains[0], *args.backfill))
+        return
+
+    chain_names = args.chains or [name for name, config in CHAINS.items() if config['rpc_url']]
+    asyncio.run(scan_chains(chain_names))
+
+
+if __name__ == "__main__":
+    main()
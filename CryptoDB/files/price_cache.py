@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+class TokenPriceCache:
+    # USD prices keyed by (platform, token address): an in-process LRU with TTL in front of the
+    # token_prices table, so a restarted enricher starts warm. Tokens CoinGecko does not know are
+    # cached with price 0.0 as well, so they are not asked for again until the TTL runs out.
+
+    def __init__(self, connect, ttl, size):
+        self.connect = connect
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, platform, addresses):
+        # Returns {address: price} for the addresses with a fresh price
+        addresses = [address.lower() for address in addresses]
+        now = time.time()
+        prices = {}
+
+        with self.lock:
+            for address in addresses:
+                entry = self.entries.get((platform, address))
+                if entry and now - entry[1] < self.ttl:
+                    self.entries.move_to_end((platform, address))
+                    prices[address] = entry[0]
+
+        misses = [address for address in dict.fromkeys(addresses) if address not in prices]
+        if misses:
+            prices.update(self.load(platform, misses))
+        return prices
+
+    def load(self, platform, addresses):
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                placeholders = ", ".join(["%s"] * len(addresses))
+                cursor.execute(
+                    "SELECT token_address, usd_price, updated_at FROM token_prices "
+                    f"WHERE platform = %s AND token_address IN ({placeholders}) AND updated_at > %s",
+                    (platform, *addresses, datetime.now() - timedelta(seconds=self.ttl)))
+                rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        prices = {}
+        with self.lock:
+            for row in rows:
+                prices[row['token_address']] = row['usd_price']
+                self._remember(platform, row['token_address'], row['usd_price'], row['updated_at'].timestamp())
+        return prices
+
+    def put_many(self, platform, prices):
+        if not prices:
+            return
+        updated_at = datetime.now()
+
+        with self.lock:
+            for address, price in prices.items():
+                self._remember(platform, address.lower(), price, updated_at.timestamp())
+
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO token_prices (platform, token_address, usd_price, updated_at) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE usd_price = VALUES(usd_price), updated_at = VALUES(updated_at)",
+                    [(platform, address.lower(), price, updated_at) for address, price in prices.items()])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _remember(self, platform, address, price, fetched_at):
+        self.entries[(platform, address)] = (price, fetched_at)
+        self.entries.move_to_end((platform, address))
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
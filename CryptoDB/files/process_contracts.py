@@ -0,0 +1,505 @@
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import pymysql
+import requests
+
+import balances
+import ratelimit
+import transfer_index
+from chains import CHAINS
+from coalesce import BatchCoalescer
+from logs import get_chain_logger
+from price_cache import TokenPriceCache
+from schema import ensure_schema
+from source_store import open_source_store
+from work_queue import WorkQueue
+
+# Secret vars
+db_host = os.getenv("MYSQL_HOST")
+db_user = os.getenv("MYSQL_NAME")
+db_password = os.getenv("MYSQL_PASSWORD")
+db_name = os.getenv("MYSQL_DATABASE")
+
+COINGECKO_BASE_URL = 'https://api.coingecko.com/api/v3'
+
+# Workers per pipeline stage and chain; API quotas are enforced by ratelimit on top of these
+STAGE_WORKERS = {
+    'balances': int(os.getenv("BALANCES_WORKERS", 4)),
+    'prices': int(os.getenv("PRICES_WORKERS", 2)),
+    'metadata': int(os.getenv("METADATA_WORKERS", 4)),
+    'write': 1,
+}
+
+# Contracts claimed from the work queue and enriched concurrently; more are claimed as soon as half
+# of them are done, so one contract stuck in a rate limit backoff does not hold up the others
+ENRICH_WINDOW = int(os.getenv("ENRICH_WINDOW", 100))
+# Finished contracts are written and acked together once this many are waiting, or WRITE_BATCH_WAIT
+# seconds after the first of them
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+WRITE_BATCH_WAIT = float(os.getenv("WRITE_BATCH_WAIT", 5))
+# Seconds to wait for new work when the queue of a chain is empty
+POLL_INTERVAL = int(os.getenv("QUEUE_POLL_INTERVAL", 30))
+# A claimed contract goes back to the queue if it is not done within the lease (enricher died);
+# a failed one is retried after RETRY_DELAY, at most MAX_ATTEMPTS times
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", 30 * 60))
+QUEUE_RETRY_DELAY = int(os.getenv("QUEUE_RETRY_DELAY", 10 * 60))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", 5))
+
+# Token prices shared by all chains, see price_cache.py
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", 60 * 60))
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", 50000))
+
+# Seconds a price lookup waits for other contracts' tokens to fill its CoinGecko request
+PRICE_BATCH_WAIT = float(os.getenv("PRICE_BATCH_WAIT", 2))
+
+# Contracts whose balances are read together through Multicall3, and how long a lookup waits for
+# other contracts to join its batch
+BALANCE_BATCH_SIZE = int(os.getenv("BALANCE_BATCH_SIZE", 200))
+BALANCE_BATCH_WAIT = float(os.getenv("BALANCE_BATCH_WAIT", 1))
+
+# Enriched contracts are upserted on the unique (chain, contract_address) key, so a contract processed
+# again (after a crash or an expired lease) updates its row instead of adding a duplicate. MySQL skips
+# the write when no value changed; notes are left to the dashboard, and token strings of rows from
+# before contract_holdings are dropped.
+UPSERT_PROCESSED_INFO = (
+    "INSERT INTO processed_contract_info (chain, contract_address, verified_code, source_hash, contract_name, "
+    "contract_usd_balance, contract_eth_balance) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE verified_code = VALUES(verified_code), source_hash = VALUES(source_hash), "
+    "contract_name = VALUES(contract_name), contract_usd_balance = VALUES(contract_usd_balance), "
+    "contract_eth_balance = VALUES(contract_eth_balance), tokens_list = NULL, tokens_balances = NULL"
+)
+
+# Touched after new rows are written, so the web app drops its cached pages (web_app/result_cache.py)
+RESULT_CACHE_STAMP = os.getenv("RESULT_CACHE_STAMP", "/root/files/processed_contract_info.stamp")
+
+
+def touch_result_cache_stamp():
+    try:
+        with open(RESULT_CACHE_STAMP, 'a'):
+            pass
+        os.utime(RESULT_CACHE_STAMP)
+    except OSError:
+        pass
+
+
+def connect_to_database():
+    return pymysql.connect(host=db_host, user=db_user, password=db_password, db=db_name, charset='utf8mb4',
+                           cursorclass=pymysql.cursors.DictCursor)
+
+
+def balance_reader(name, config):
+    # balances.get_balances, or its variant taking token balances from the Transfer log index
+    # when the scanner keeps one for the chain
+    if not config['transfer_index']:
+        return balances.get_balances
+    return partial(transfer_index.get_balances,
+                   transfer_index.TransferIndexer(connect_to_database, name, config['tracked_tokens']),
+                   config['confirmations'])
+
+
+def fetch_tokens_prices(price_cache, platform, tokens_addresses):
+    # One CoinGecko request for at most price_chunk_size lowercase addresses; the answers are cached
+    url = f"{COINGECKO_BASE_URL}/simple/token_price/{platform}"
+    vs_currencies = "usd"
+
+    params = {
+        'contract_addresses': ','.join(tokens_addresses),
+        'vs_currencies': vs_currencies
+    }
+
+    response = ratelimit.get('coingecko', url, params=params)
+    data = response.json()
+
+    prices = {address: data.get(address, {}).get(vs_currencies, 0.0) for address in tokens_addresses}
+    price_cache.put_many(platform, prices)
+    return prices
+
+
+def tracked_holdings(tracked_tokens, token_balances):
+    # Held tokens [(address, symbol, balance)] from raw balanceOf results, and the lowercase
+    # addresses of tracked tokens whose balanceOf failed
+    held = []
+    failed = set()
+    for address, symbol, decimals in tracked_tokens:
+        if token_balances.get(address) is None:
+            failed.add(address.lower())
+        elif token_balances[address]:
+            held.append((address, symbol, round(token_balances[address] / 10 ** decimals, 2)))
+    return held, failed
+
+
+def summarize_holdings(eth_balance, held, tokens_prices):
+    # processed_contract_info values for a native balance and [(token address, symbol, balance)],
+    # with the contract_holdings rows [(token, symbol, balance, usd value)] of its tokens
+    usd_balance = 0
+    holdings = []
+    for (address, symbol, balance), price in zip(held, tokens_prices):
+        usd_value = balance * float(price)
+        usd_balance += usd_value
+        if address:
+            holdings.append((address.lower(), ("ERR" if symbol is None else symbol)[:64], balance, round(usd_value, 2)))
+
+    return {
+        "contract_eth_balance": round(float(eth_balance), 1),
+        "contract_usd_balance": round(float(usd_balance)),
+        "holdings": holdings,
+    }
+
+
+def replace_holdings(cursor, contracts):
+    # Stores {contract id: (chain label, contract address, holdings)} in contract_holdings in place
+    # of what the contracts held before
+    if not contracts:
+        return
+    placeholders = ", ".join(["%s"] * len(contracts))
+    cursor.execute(f"DELETE FROM contract_holdings WHERE contract_id IN ({placeholders})", tuple(contracts))
+    rows = [(contract_id, chain, address, *holding)
+            for contract_id, (chain, address, holdings) in contracts.items() for holding in holdings]
+    if rows:
+        cursor.executemany("INSERT INTO contract_holdings (contract_id, chain, contract_address, token, symbol, balance, "
+                           "usd_value) VALUES (%s, %s, %s, %s, %s, %s, %s)", rows)
+
+
+class ContractMetadata:
+    # Every field derived from one Etherscan getsourcecode answer, which holds the ABI, name and source
+
+    def __init__(self, result):
+        self.abi = result.get('ABI')
+        self.contract_name = result.get('ContractName') or "Unknown Contract"
+        self.source_code = result.get('SourceCode')
+
+    @property
+    def verified_code(self) -> bool:
+        return bool(self.source_code) and self.abi != "Contract source code not verified"
+
+
+class ChainEnricher:
+    def __init__(self, name, config, price_cache, source_store):
+        self.name = name
+        self.config = config
+        self.price_cache = price_cache
+        self.source_store = source_store
+        self.queue = WorkQueue(connect_to_database, name, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS)
+        self.logger = get_chain_logger('process_contracts', name, config['enrich_log_file'])
+        self.stages = {stage: asyncio.Semaphore(workers) for stage, workers in STAGE_WORKERS.items()}
+        # Stage "prices": token addresses of all contracts in flight are deduplicated and sent together
+        self.price_resolver = BatchCoalescer(self.resolve_prices, config['price_chunk_size'], PRICE_BATCH_WAIT)
+        # Stage "balances": native and tracked token balances of many contracts per Multicall3 batch
+        self.balance_resolver = BatchCoalescer(self.resolve_balances, BALANCE_BATCH_SIZE, BALANCE_BATCH_WAIT)
+        self.read_balances = balance_reader(name, config)
+        # Stage "write": rows of contracts finishing close together in one upsert, then their queue items
+        # acked or retried. Outcomes wait in self.outcomes by queue item id until their batch is sent.
+        self.outcomes = {}
+        self.finisher = BatchCoalescer(self.finish, WRITE_BATCH_SIZE, WRITE_BATCH_WAIT)
+
+    def make_request(self, url, params=None):
+        try:
+            response = ratelimit.get(f"etherscan_{self.name}", url, params=params)
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error making request: {e}")
+            return None
+
+    def get_contract_metadata(self, address: str):
+        params = {"apikey": self.config['etherscan_api_key'], "module": "contract", "action": "getsourcecode", "address": address}
+        data = self.make_request(self.config['etherscan_url'], params)
+        if not data or data.get('status') != '1' or not data.get('result'):
+            raise ValueError(f"No getsourcecode answer for {address}: {data}")
+        return ContractMetadata(data['result'][0])
+
+    def get_balance(self, address: str):
+        try:
+            url = f"{self.config['etherscan_url']}?module=account&action=balance&address={address}&tag=latest&apikey={self.config['etherscan_api_key']}"
+            response = ratelimit.get(f"etherscan_{self.name}", url)
+            data = response.json()
+            return int(data['result']) / 10**18 if data and data.get('status') == '1' else None
+        except requests.exceptions.RequestException:
+            return None
+
+    def get_smartcontract_balance(self, smartcontract_address):
+        base_url = "https://api.covalenthq.com/v1/"
+        endpoint = f"{self.config['covalent_chain']}/address/{smartcontract_address}/balances_v2/"
+
+        url = f"{base_url}{endpoint}?key={self.config['covalent_api_key']}"
+        try:
+            response = ratelimit.get(f"covalent_{self.name}", url)
+            return response.json()
+
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error: {e}")
+            return None
+
+    async def resolve_prices(self, tokens_addresses):
+        async with self.stages['prices']:
+            return await asyncio.to_thread(
+                fetch_tokens_prices, self.price_cache, self.config['coingecko_platform'], tokens_addresses)
+
+    async def get_tokens_prices(self, tokens_addresses):
+        # A failed CoinGecko request raises, so the contracts of its batch are retried instead of
+        # being written with their tokens valued at zero
+        prices = await asyncio.to_thread(
+            self.price_cache.get_many, self.config['coingecko_platform'], tokens_addresses)
+        misses = [address for address in dict.fromkeys(map(str.lower, tokens_addresses)) if address not in prices]
+        if misses:
+            prices.update(await self.price_resolver.get_many(misses))
+
+        return [prices[address.lower()] for address in tokens_addresses]
+
+    def get_last_checked_time(self):
+        if os.path.exists(self.config['last_checked_file']):
+            with open(self.config['last_checked_file'], "r") as file:
+                last_checked_time_str = file.read().strip()
+            try:
+                return datetime.strptime(last_checked_time_str, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                return datetime.min
+        else:
+            return datetime.min
+
+    def seed_queue(self):
+        # Once per chain: contracts stored before the work queue existed are queued from the old
+        # created_at checkpoint on (all of them without one), then the checkpoint is retired
+        seeded_marker = f"{self.config['last_checked_file']}.queued"
+        if os.path.exists(seeded_marker):
+            return
+
+        last_checked_time = self.get_last_checked_time()
+        seeded = self.queue.seed(self.config['table'], last_checked_time)
+        self.logger.info(f"Queued {seeded} contracts found since {last_checked_time}")
+
+        if os.path.exists(self.config['last_checked_file']):
+            os.replace(self.config['last_checked_file'], seeded_marker)
+        else:
+            with open(seeded_marker, "w") as file:
+                file.write(last_checked_time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def write_processed_info(self, rows):
+        # Writes a batch of enriched contracts with one multi-row upsert, and their holdings
+        # in the same transaction
+        connection = connect_to_database()
+
+        try:
+            # The source is kept once per content hash in the source store
+            source_hashes = [self.source_store.put(connection, data["source_code"]) if data["source_code"] else None
+                             for data in rows]
+
+            with connection.cursor() as cursor:
+                cursor.executemany(UPSERT_PROCESSED_INFO, [(
+                    self.config['label'],
+                    data["contract_address"],
+                    data["verified_code"],
+                    source_hash,
+                    data["contract_name"],
+                    data["contract_usd_balance"],
+                    data["contract_eth_balance"],
+                ) for data, source_hash in zip(rows, source_hashes)])
+
+                placeholders = ", ".join(["%s"] * len(rows))
+                cursor.execute(f"SELECT id, contract_address FROM processed_contract_info "
+                               f"WHERE chain = %s AND contract_address IN ({placeholders})",
+                               (self.config['label'], *[data["contract_address"] for data in rows]))
+                ids = {row['contract_address'].lower(): row['id'] for row in cursor.fetchall()}
+
+                replace_holdings(cursor, {
+                    ids[data["contract_address"].lower()]: (self.config['label'], data["contract_address"], data["holdings"])
+                    for data in rows
+                })
+            connection.commit()
+        except (pymysql.Error, OSError) as e:
+            self.logger.error(f"Error inserting data: {e}")
+            raise
+        finally:
+            connection.close()
+
+    def parse_token_balances(self, data):
+        items = data.get('data', {}).get('items', [])
+
+        filtered_tokens = [token_info for token_info in items if token_info.get('contract_ticker_symbol') != self.config['native_symbol']]
+
+        tokens_addresses = [token_info.get('contract_address') for token_info in filtered_tokens]
+        tokens_symbols = ["ERR" if token_info.get('contract_ticker_symbol') is None else token_info.get('contract_ticker_symbol') for token_info in filtered_tokens]
+        tokens_balances = [
+            round(int(token_info.get('balance')) / 10 ** int(token_info['contract_decimals']) if token_info.get('contract_decimals') else 18, 2)
+            for token_info in filtered_tokens
+        ]
+        return bool(items), tokens_addresses, tokens_symbols, tokens_balances
+
+    async def resolve_balances(self, addresses):
+        tokens = [address for address, _, _ in self.config['tracked_tokens']]
+        async with self.stages['balances']:
+            return await asyncio.to_thread(
+                ratelimit.call, f"rpc_{self.name}", self.read_balances, self.config['rpc_url'], addresses, tokens)
+
+    async def fetch_covalent_holdings(self, smartcontract_address):
+        # Native balance from Etherscan and every token from Covalent, for chains without an RPC url
+        async with self.stages['balances']:
+            token_balances, eth_balance = await asyncio.gather(
+                asyncio.to_thread(self.get_smartcontract_balance, smartcontract_address),
+                asyncio.to_thread(self.get_balance, smartcontract_address),
+            )
+
+        if not token_balances or token_balances.get('error', False):
+            raise ValueError(f"Проблема с получением балансов токенов для адреса {smartcontract_address}")
+
+        has_items, tokens_addresses, tokens_symbols, tokens_balances = self.parse_token_balances(token_balances)
+        if not has_items:
+            return None
+        if eth_balance is None:
+            raise ValueError(f"No native balance for {smartcontract_address}")
+        return eth_balance, list(zip(tokens_addresses, tokens_symbols, tokens_balances))
+
+    async def fetch_multicall_holdings(self, smartcontract_address):
+        # Native balance and tracked tokens through Multicall3. The tokens Multicall3 cannot see,
+        # untracked ones and tracked ones whose balanceOf failed, come from Covalent when it is
+        # configured; a failed Covalent request raises, so a contract is not taken for empty when
+        # only its tracked tokens were checked.
+        native_balance, token_balances = (await self.balance_resolver.get_many([smartcontract_address]))[smartcontract_address]
+
+        held, failed = tracked_holdings(self.config['tracked_tokens'], token_balances)
+        if self.config['covalent_api_key']:
+            tracked = {address.lower() for address, _, _ in self.config['tracked_tokens']}
+            async with self.stages['balances']:
+                data = await asyncio.to_thread(self.get_smartcontract_balance, smartcontract_address)
+            if not data or data.get('error', False):
+                raise ValueError(f"No Covalent token balances for {smartcontract_address}")
+            _, tokens_addresses, tokens_symbols, tokens_balances = self.parse_token_balances(data)
+            held += [token for token in zip(tokens_addresses, tokens_symbols, tokens_balances)
+                     if token[0] and (token[0].lower() not in tracked or token[0].lower() in failed)]
+
+        if not native_balance and not held:
+            return None
+        return native_balance / 10 ** 18, held
+
+    async def fetch_holdings(self, smartcontract_address):
+        # Stages "balances" and "prices": token and native balances, then the USD value of the tokens
+        if self.config['rpc_url']:
+            holdings = await self.fetch_multicall_holdings(smartcontract_address)
+        else:
+            holdings = await self.fetch_covalent_holdings(smartcontract_address)
+
+        if holdings is None:
+            self.logger.info("No data about token balances")
+            return None
+        eth_balance, held = holdings
+
+        tokens_prices = await self.get_tokens_prices([address for address, _, _ in held]) if held else []
+        return summarize_holdings(eth_balance, held, tokens_prices)
+
+    async def fetch_metadata(self, smartcontract_address):
+        # Stage "metadata": verification, name and source code from one Etherscan-family call
+        async with self.stages['metadata']:
+            metadata = await asyncio.to_thread(self.get_contract_metadata, smartcontract_address)
+        return {
+            "contract_name": metadata.contract_name,
+            "verified_code": metadata.verified_code,
+            "source_code": metadata.source_code,
+        }
+
+    async def process_contract(self, smartcontract_address):
+        # (True, its row or None when it holds nothing to record) once the contract is enriched,
+        # (False, None) to retry it. Most new contracts hold nothing, so Etherscan (the tightest
+        # quota) is only asked about the ones that do.
+        try:
+            holdings = await self.fetch_holdings(smartcontract_address)
+            if holdings is None:
+                return True, None
+            metadata = await self.fetch_metadata(smartcontract_address)
+
+            processed_data = {"contract_address": smartcontract_address, **holdings, **metadata}
+            self.logger.info(processed_data)
+            return True, processed_data
+
+        except Exception as e:
+            self.logger.error(f"Ошибка при обработке контракта {smartcontract_address}: {e}")
+            return False, None
+
+    async def finish(self, item_ids):
+        outcomes = {item_id: self.outcomes.pop(item_id) for item_id in item_ids}
+        rows = {item_id: data for item_id, (_, data) in outcomes.items() if data}
+        failed = [item_id for item_id, (ok, _) in outcomes.items() if not ok]
+
+        if rows:
+            try:
+                async with self.stages['write']:
+                    await asyncio.to_thread(self.write_processed_info, list(rows.values()))
+                # Cached dashboard pages are dropped only when rows were written
+                touch_result_cache_stamp()
+            except (pymysql.Error, OSError):
+                failed += list(rows)
+
+        done = [item_id for item_id in item_ids if item_id not in failed]
+        await asyncio.to_thread(self.queue.ack, done)
+        await asyncio.to_thread(self.queue.retry, failed, QUEUE_RETRY_DELAY)
+        self.logger.info(f"Обработано контрактов: {len(done)}, с ошибкой: {len(failed)}")
+        return dict.fromkeys(item_ids)
+
+    async def enrich(self, item_id, smartcontract_address):
+        self.outcomes[item_id] = await self.process_contract(smartcontract_address)
+        try:
+            await self.finisher.get_many([item_id])
+        except Exception as e:
+            # The item is claimed again once its lease runs out
+            self.logger.error("Error: %s", str(e), exc_info=True)
+
+    async def run(self):
+        # Keeps up to ENRICH_WINDOW contracts in flight for as long as the work queue has any
+        await asyncio.to_thread(self.seed_queue)
+        in_flight = set()
+        next_claim = 0
+        while True:
+            try:
+                free = ENRICH_WINDOW - len(in_flight)
+                if free >= max(1, ENRICH_WINDOW // 2) and time.monotonic() >= next_claim:
+                    claimed = await asyncio.to_thread(self.queue.claim, free)
+                    if not claimed:
+                        next_claim = time.monotonic() + POLL_INTERVAL
+                    for item_id, address in claimed:
+                        task = asyncio.create_task(self.enrich(item_id, address))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+
+                wait = next_claim - time.monotonic()
+                if in_flight:
+                    await asyncio.wait(in_flight, timeout=wait if wait > 0 else None,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                elif wait > 0:
+                    await asyncio.sleep(wait)
+
+            except Exception as e:
+                self.logger.error("Error: %s", str(e), exc_info=True)
+                next_claim = time.monotonic() + POLL_INTERVAL
+
+
+async def enrich_chains(chain_names):
+    # Each stage worker runs its blocking API calls in threads: two at once for balances
+    workers = len(chain_names) * (2 * STAGE_WORKERS['balances'] + STAGE_WORKERS['prices'] +
+                                  STAGE_WORKERS['metadata'] + STAGE_WORKERS['write'] + 1)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+
+    await asyncio.to_thread(ensure_schema, connect_to_database)
+    price_cache = TokenPriceCache(connect_to_database, PRICE_CACHE_TTL, PRICE_CACHE_SIZE)
+    source_store = open_source_store()
+    enrichers = [ChainEnricher(name, CHAINS[name], price_cache, source_store) for name in chain_names]
+    await asyncio.gather(*(enricher.run() for enricher in enrichers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect balances, prices and source code of the found contracts")
+    parser.add_argument('chains', nargs='*', help=f"chains to process: {', '.join(CHAINS)} (default: all)")
+    args = parser.parse_args()
+
+    unknown_chains = set(args.chains) - set(CHAINS)
+    if unknown_chains:
+        parser.error(f"unknown chains: {', '.join(sorted(unknown_chains))}")
+
+    asyncio.run(enrich_chains(args.chains or list(CHAINS)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import sessions
+
+# Default request rates per second by upstream kind, overridable per upstream
+# with RATE_LIMIT_<UPSTREAM>, e.g. RATE_LIMIT_RPC_ETH=20 or RATE_LIMIT_COINGECKO=0.2
+RATE_LIMITS = {
+    'rpc': 10,
+    'etherscan': 5,
+    'covalent': 4,
+    'coingecko': 0.5,
+}
+
+BASE_BACKOFF = 1
+MAX_BACKOFF = 15 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    def __init__(self, message="Rate limit exceeded", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    # Token bucket whose rate follows the real quota: halved on every rate limit answer,
+    # then regained in small steps on successful calls up to the configured rate.
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.max_rate = rate
+        self.min_rate = rate / 64
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_rate_limited(self, delay):
+        with self.lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            self.updated = now
+            self.blocked_until = max(self.blocked_until, now + delay)
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream):
+    # upstream is '<kind>' or '<kind>_<chain>', e.g. 'coingecko' or 'etherscan_bsc'
+    with limiters_lock:
+        if upstream not in limiters:
+            kind = upstream.split('_')[0]
+            rate = float(os.getenv(f"RATE_LIMIT_{upstream.upper()}", RATE_LIMITS[kind]))
+            limiters[upstream] = RateLimiter(upstream, rate)
+        return limiters[upstream]
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def call(upstream, func, *args, **kwargs):
+    # Calls func under the upstream's limiter and retries the same call after a rate limit
+    limiter = get_limiter(upstream)
+    attempt = 0
+
+    while True:
+        limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 429:
+                raise
+            retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+        except RateLimited as e:
+            retry_after = e.retry_after
+        else:
+            limiter.on_success()
+            return result
+
+        backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+        delay = max(retry_after or 0, backoff)
+        attempt += 1
+        logger.warning("%s rate limit exceeded, retrying in %.1f s (attempt %d)", upstream, delay, attempt)
+        limiter.on_rate_limited(delay)
+
+
+def _get(url, params=None, **kwargs):
+    response = sessions.get(url, params=params, **kwargs)
+    response.raise_for_status()
+
+    # Etherscan-family APIs answer a rate limit with HTTP 200 and status "0"
+    if 'json' in response.headers.get('Content-Type', ''):
+        data = response.json()
+        if isinstance(data, dict) and data.get('status') == '0' and 'rate limit' in str(data.get('result')).lower():
+            raise RateLimited(data.get('result'))
+    return response
+
+
+def get(upstream, url, params=None, **kwargs):
+    return call(upstream, _get, url, params=params, **kwargs)
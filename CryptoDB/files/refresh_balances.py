@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import time
+
+import ratelimit
+from chains import CHAINS
+from logs import get_chain_logger
+from price_cache import TokenPriceCache
+from process_contracts import (PRICE_CACHE_SIZE, PRICE_CACHE_TTL, balance_reader, connect_to_database,
+                               fetch_tokens_prices, replace_holdings, summarize_holdings, touch_result_cache_stamp,
+                               tracked_holdings)
+from schema import ensure_schema
+
+# Stored balances are re-read on a schedule that depends on their value: a contract belongs to the
+# first tier whose minimum USD value (tokens and native balance) it reaches, and every tier is swept
+# once per interval.
+TIERS = [
+    ('high', float(os.getenv("REFRESH_HIGH_USD", 100000)), int(os.getenv("REFRESH_HIGH_INTERVAL", 60 * 60))),
+    ('mid', float(os.getenv("REFRESH_MID_USD", 1000)), int(os.getenv("REFRESH_MID_INTERVAL", 6 * 60 * 60))),
+    ('low', None, int(os.getenv("REFRESH_LOW_INTERVAL", 24 * 60 * 60))),
+]
+
+# Contracts per Multicall3 batch and per page read from the table
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", 500))
+# Sweep positions of every chain and tier, so a restarted job continues where it stopped
+REFRESH_STATE_DIR = os.getenv("REFRESH_STATE_DIR", "/root/files/refresh")
+# Seconds to sleep when no tier is due
+IDLE_INTERVAL = 60
+
+# Columns a refresh recomputes. A row is written when its native or token balances changed, or when
+# price moves shifted its USD value by more than REFRESH_USD_DRIFT (a fraction of the stored value);
+# prices alone change on every CoinGecko update, which would rewrite nearly every row each sweep.
+REFRESHED_COLUMNS = ("contract_eth_balance", "contract_usd_balance")
+REFRESH_USD_DRIFT = float(os.getenv("REFRESH_USD_DRIFT", 0.1))
+
+
+class TierCursor:
+    # Progress of the sweeps of one chain and tier: the last id of the sweep in progress (0 when
+    # none is) and when the last sweep finished
+
+    def __init__(self, path):
+        self.path = path
+        self.last_id = 0
+        self.finished_at = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            self.last_id = state['last_id']
+            self.finished_at = state['finished_at']
+
+    def due(self, interval):
+        return self.last_id > 0 or time.time() - self.finished_at >= interval
+
+    def advance(self, last_id):
+        self.last_id = last_id
+        self.save()
+
+    def finish(self):
+        self.last_id = 0
+        self.finished_at = time.time()
+        self.save()
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'last_id': self.last_id, 'finished_at': self.finished_at}, file)
+        os.replace(temp_path, self.path)
+
+
+class ChainRefresher:
+    def __init__(self, name, config, price_cache):
+        self.name = name
+        self.config = config
+        self.price_cache = price_cache
+        self.read_balances = balance_reader(name, config)
+        self.logger = get_chain_logger('refresh_balances', name, config['refresh_log_file'])
+        self.cursors = [TierCursor(os.path.join(REFRESH_STATE_DIR, f"{name}_{tier}.json")) for tier, _, _ in TIERS]
+        self.changed = [0] * len(TIERS)
+
+    def tier_condition(self, tier_index, native_price):
+        # Tiers go by total value: the stored token USD balance plus the native balance at the
+        # price of its wrapped token
+        value = "contract_usd_balance + contract_eth_balance * %s"
+        lower = TIERS[tier_index][1]
+        upper = TIERS[tier_index - 1][1] if tier_index else None
+        sql = ""
+        params = []
+        if lower is not None:
+            sql += f" AND {value} >= %s"
+            params.extend([native_price, lower])
+        if upper is not None:
+            sql += f" AND {value} < %s"
+            params.extend([native_price, upper])
+        return sql, params
+
+    def read_rows(self, tier_index, last_id):
+        wrapped_native = self.config['wrapped_native']
+        condition, params = self.tier_condition(tier_index, self.get_prices([wrapped_native])[wrapped_native.lower()])
+        connection = connect_to_database()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT id, contract_address, tokens_list, {', '.join(REFRESHED_COLUMNS)} FROM processed_contract_info "
+                    f"WHERE chain = %s AND id > %s{condition} ORDER BY id LIMIT %s",
+                    (self.config['label'], last_id, *params, REFRESH_BATCH_SIZE))
+                return cursor.fetchall()
+        finally:
+            connection.close()
+
+    def get_prices(self, tokens_addresses):
+        platform = self.config['coingecko_platform']
+        tokens_addresses = [address.lower() for address in tokens_addresses]
+        prices = self.price_cache.get_many(platform, tokens_addresses)
+        misses = [address for address in tokens_addresses if address not in prices]
+        for i in range(0, len(misses), self.config['price_chunk_size']):
+            prices.update(fetch_tokens_prices(self.price_cache, platform, misses[i:i + self.config['price_chunk_size']]))
+        return prices
+
+    def read_holdings(self, rows):
+        # {contract id: {token: (symbol, balance, usd value)}} from contract_holdings for the rows of a batch
+        placeholders = ", ".join(["%s"] * len(rows))
+        connection = connect_to_database()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT contract_id, token, symbol, balance, usd_value FROM contract_holdings "
+                               f"WHERE contract_id IN ({placeholders})", tuple(row['id'] for row in rows))
+                holdings = {}
+                for holding in cursor.fetchall():
+                    holdings.setdefault(holding['contract_id'], {})[holding['token'].lower()] = (
+                        holding['symbol'], holding['balance'], holding['usd_value'])
+                return holdings
+        finally:
+            connection.close()
+
+    def refresh_rows(self, rows):
+        # Re-reads the balances of rows and writes the ones that changed; returns their number.
+        # Only tracked tokens can be re-read: other holdings (found through Covalent) keep their
+        # stored balance and USD value, and rows enriched before contract_holdings, whose token
+        # strings name no addresses, are left alone.
+        rows = [row for row in rows if not row['tokens_list']]
+        if not rows:
+            return 0
+        tracked_tokens = self.config['tracked_tokens']
+        tracked = {address.lower() for address, _, _ in tracked_tokens}
+        results = ratelimit.call(f"rpc_{self.name}", self.read_balances, self.config['rpc_url'],
+                                 [row['contract_address'] for row in rows], [address for address, _, _ in tracked_tokens])
+        prices = self.get_prices([address for address, _, _ in tracked_tokens])
+        stored_holdings = self.read_holdings(rows)
+
+        updates = []
+        holdings = {}
+        for row in rows:
+            native_balance, token_balances = results[row['contract_address']]
+            held, failed = tracked_holdings(tracked_tokens, token_balances)
+            if failed:
+                # A balance could not be read; the stored values stay until the next sweep
+                continue
+
+            values = summarize_holdings(native_balance / 10 ** 18, held, [prices[address.lower()] for address, _, _ in held])
+            stored = stored_holdings.get(row['id'], {})
+            untracked = [(token, *holding) for token, holding in stored.items() if token not in tracked]
+            values["contract_usd_balance"] = round(values["contract_usd_balance"] + sum(usd for *_, usd in untracked))
+
+            balances_changed = (
+                values["contract_eth_balance"] != row["contract_eth_balance"]
+                or {token: balance for token, _, balance, _ in values["holdings"]}
+                != {token: holding[1] for token, holding in stored.items() if token in tracked}
+            )
+            usd_drift = abs(values["contract_usd_balance"] - row["contract_usd_balance"])
+            if balances_changed or usd_drift > REFRESH_USD_DRIFT * max(row["contract_usd_balance"], 1):
+                updates.append((*(values[column] for column in REFRESHED_COLUMNS), row['id']))
+                holdings[row['id']] = (self.config['label'], row['contract_address'], values["holdings"] + untracked)
+
+        if updates:
+            connection = connect_to_database()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f"UPDATE processed_contract_info SET {', '.join(f'{column} = %s' for column in REFRESHED_COLUMNS)}, "
+                        "tokens_list = NULL, tokens_balances = NULL WHERE id = %s", updates)
+                    replace_holdings(cursor, holdings)
+                connection.commit()
+            finally:
+                connection.close()
+            touch_result_cache_stamp()
+        return len(updates)
+
+    def step(self, tier_index):
+        # Refreshes the next batch of a due tier; False when the tier had nothing to do
+        tier, _, interval = TIERS[tier_index]
+        cursor = self.cursors[tier_index]
+        if not cursor.due(interval):
+            return False
+
+        rows = self.read_rows(tier_index, cursor.last_id)
+        if not rows:
+            self.logger.info(f"Tier {tier} refreshed, {self.changed[tier_index]} contracts changed")
+            self.changed[tier_index] = 0
+            cursor.finish()
+            return False
+
+        self.changed[tier_index] += self.refresh_rows(rows)
+        cursor.advance(rows[-1]['id'])
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-read the balances of processed contracts, valuable ones more often")
+    parser.add_argument('chains', nargs='*', help=f"chains to refresh: {', '.join(CHAINS)} (default: every chain with an RPC url)")
+    parser.add_argument('--once', action='store_true', help="finish the due sweeps and exit")
+    args = parser.parse_args()
+
+    unknown_chains = set(args.chains) - set(CHAINS)
+    if unknown_chains:
+        parser.error(f"unknown chains: {', '.join(sorted(unknown_chains))}")
+    chain_names = [name for name in args.chains or CHAINS if CHAINS[name]['rpc_url']]
+
+    ensure_schema(connect_to_database)
+    os.makedirs(REFRESH_STATE_DIR, exist_ok=True)
+    price_cache = TokenPriceCache(connect_to_database, PRICE_CACHE_TTL, PRICE_CACHE_SIZE)
+    refreshers = [ChainRefresher(name, CHAINS[name], price_cache) for name in chain_names]
+
+    # One batch per due tier and chain in turn, so a long sweep does not hold up the others
+    while True:
+        worked = False
+        for refresher in refreshers:
+            for tier_index in range(len(TIERS)):
+                try:
+                    worked = refresher.step(tier_index) or worked
+                except Exception as e:
+                    refresher.logger.error("Error: %s", str(e), exc_info=True)
+
+        if not worked:
+            if args.once:
+                break
+            time.sleep(IDLE_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import sessions
+from ratelimit import RateLimited
+
+# Maximum number of calls packed into one JSON-RPC batch request
+MAX_BATCH_CALLS = 100
+
+# JSON-RPC error codes nodes use for "request rate exceeded"
+RATE_LIMIT_ERRORS = (-32005, 429)
+
+# Messages of eth_getLogs answers over the node's result cap. Infura sends them with -32005 too, and
+# retrying the same range after a backoff would fail forever; the range has to be split instead.
+TOO_MANY_RESULTS_MESSAGES = ("query returned more than", "response size exceeded", "too many results",
+                             "block range is too large", "exceed maximum block range")
+
+
+class TooManyResults(ValueError):
+    pass
+
+
+def rpc_batch(url, calls):
+    # calls: list of (method, params); results are returned in the same order
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    response = sessions.post(url, json=payload)
+    response.raise_for_status()
+
+    # The node may answer batch entries in any order
+    results = sorted(response.json(), key=lambda item: item["id"])
+    if len(results) != len(calls):
+        raise ValueError(f"Batch of {len(calls)} calls returned {len(results)} results")
+
+    values = []
+    for item in results:
+        message = str((item.get("error") or {}).get("message", "")).lower()
+        if item.get("error") and any(pattern in message for pattern in TOO_MANY_RESULTS_MESSAGES):
+            raise TooManyResults(item["error"].get("message"))
+        if item.get("error") and item["error"].get("code") in RATE_LIMIT_ERRORS:
+            raise RateLimited(item["error"].get("message"))
+        if item.get("error"):
+            method, params = calls[item["id"]]
+            raise ValueError(f"{method}{params} failed: {item['error']}")
+        values.append(item.get("result"))
+    return values
+
+
+def rpc_call(url, method, params):
+    return rpc_batch(url, [(method, params)])[0]
+
+
+def get_block_number(url):
+    return int(rpc_call(url, "eth_blockNumber", []), 16)
+
+
+def get_blocks(url, block_numbers, full_transactions=True):
+    blocks = rpc_batch(url, [("eth_getBlockByNumber", [hex(number), full_transactions]) for number in block_numbers])
+    for number, block in zip(block_numbers, blocks):
+        if block is None:
+            raise ValueError(f"Block {number} not returned")
+    return blocks
+
+
+def get_codes(url, addresses):
+    codes = []
+    for i in range(0, len(addresses), MAX_BATCH_CALLS):
+        chunk = addresses[i:i + MAX_BATCH_CALLS]
+        codes += rpc_batch(url, [("eth_getCode", [address, "latest"]) for address in chunk])
+    return codes
+
+
+def get_block_receipts(url, block_numbers):
+    # eth_getBlockReceipts is not served by every node, see the block_receipts chain setting
+    return rpc_batch(url, [("eth_getBlockReceipts", [hex(number)]) for number in block_numbers])
+
+
+def get_receipts(url, tx_hashes):
+    receipts = []
+    for i in range(0, len(tx_hashes), MAX_BATCH_CALLS):
+        chunk = tx_hashes[i:i + MAX_BATCH_CALLS]
+        receipts += rpc_batch(url, [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in chunk])
+    return receipts
+
+
+def get_logs(url, addresses, topics, from_block, to_block):
+    # Nodes cap the blocks or results of one eth_getLogs, see the log_range_size chain setting
+    return rpc_call(url, "eth_getLogs", [{
+        "address": addresses,
+        "topics": topics,
+        "fromBlock": hex(from_block),
+        "toBlock": hex(to_block),
+    }])
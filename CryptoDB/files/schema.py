@@ -0,0 +1,271 @@
+import argparse
+import os
+
+import pymysql
+
+from chains import CHAINS
+
+# Tables used by the scanner, the enricher and the web app. Migrations run in order and each one
+# only once; applied versions are recorded in schema_migrations. Steps are SQL strings or
+# functions taking a cursor, and are written so that a database created before this module (by
+# hand, or by older versions creating tables on the fly) is brought up to date as well.
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (version)
+)
+"""
+
+CREATE_CONTRACT_ADDRESSES = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    address VARCHAR(42) NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_address (address),
+    KEY idx_created_at (created_at)
+)
+"""
+
+CREATE_PROCESSED_CONTRACT_INFO = """
+CREATE TABLE IF NOT EXISTS processed_contract_info (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    contract_address VARCHAR(42) NOT NULL,
+    verified_code TINYINT(1) NOT NULL DEFAULT 0,
+    tokens_balances VARCHAR(100),
+    tokens_list VARCHAR(100),
+    source_code LONGTEXT,
+    contract_name VARCHAR(255),
+    contract_usd_balance DOUBLE NOT NULL DEFAULT 0,
+    contract_eth_balance DOUBLE NOT NULL DEFAULT 0,
+    notes TEXT,
+    chain VARCHAR(8) NOT NULL,
+    PRIMARY KEY (id)
+)
+"""
+
+CREATE_TOKEN_PRICES = """
+CREATE TABLE IF NOT EXISTS token_prices (
+    platform VARCHAR(64) NOT NULL,
+    token_address VARCHAR(64) NOT NULL,
+    usd_price DOUBLE NOT NULL,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY (platform, token_address)
+)
+"""
+
+CREATE_SOURCE_BLOBS = """
+CREATE TABLE IF NOT EXISTS source_blobs (
+    source_hash CHAR(64) NOT NULL,
+    size INT UNSIGNED NOT NULL,
+    compressed MEDIUMBLOB NOT NULL,
+    PRIMARY KEY (source_hash)
+)
+"""
+
+# Contracts waiting for enrichment, see work_queue.py. Rows stay after they are done, so the
+# unique key keeps a contract from being queued twice.
+CREATE_CONTRACT_QUEUE = """
+CREATE TABLE IF NOT EXISTS contract_queue (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    chain VARCHAR(8) NOT NULL,
+    address VARCHAR(42) NOT NULL,
+    state TINYINT NOT NULL DEFAULT 0,
+    attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    lease_until DATETIME NULL,
+    claimed_by VARCHAR(128) NULL,
+    enqueued_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_chain_address (chain, address),
+    KEY idx_claim (chain, state, id)
+)
+"""
+
+# Tracked token balances kept current by the Transfer log indexer (transfer_index.py), with the
+# block it has applied per chain
+CREATE_INDEXED_BALANCES = """
+CREATE TABLE IF NOT EXISTS indexed_balances (
+    chain VARCHAR(8) NOT NULL,
+    contract_address VARCHAR(42) NOT NULL,
+    token VARCHAR(42) NOT NULL,
+    balance DECIMAL(65, 0) NOT NULL,
+    last_block BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (chain, contract_address, token)
+)
+"""
+
+CREATE_TRANSFER_INDEX_PROGRESS = """
+CREATE TABLE IF NOT EXISTS transfer_index_progress (
+    chain VARCHAR(8) NOT NULL,
+    last_block BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (chain)
+)
+"""
+
+# Token holdings of processed contracts, one row per token. contract_id is the id of the
+# processed_contract_info row; idx_symbol_usd answers the "holds token above USD value" filter.
+CREATE_CONTRACT_HOLDINGS = """
+CREATE TABLE IF NOT EXISTS contract_holdings (
+    contract_id BIGINT UNSIGNED NOT NULL,
+    chain VARCHAR(8) NOT NULL,
+    contract_address VARCHAR(42) NOT NULL,
+    token VARCHAR(42) NOT NULL,
+    symbol VARCHAR(64) NOT NULL,
+    balance DOUBLE NOT NULL,
+    usd_value DOUBLE NOT NULL,
+    PRIMARY KEY (contract_id, token),
+    KEY idx_symbol_usd (symbol, usd_value, contract_id)
+)
+"""
+
+# Indexes for the filters of the dashboard (web_app/filters.py): equality filters (chain,
+# verified_code) first, then the balance that is filtered or sorted on, then id for the keyset
+# order. The page query only reads ids from them, so each one covers the filter path it serves.
+# verified_code is "all" by default, so chain is also followed directly by each balance; chain
+# and id alone is idx_chain_id (migration 7).
+# web_app/check_query_plans.py checks that every filter combination is answered by one of them.
+FILTER_INDEXES = {
+    'idx_chain_verified_usd': ('chain', 'verified_code', 'contract_usd_balance', 'id'),
+    'idx_chain_verified_eth': ('chain', 'verified_code', 'contract_eth_balance', 'id'),
+    'idx_chain_verified_id': ('chain', 'verified_code', 'id'),
+    'idx_chain_usd': ('chain', 'contract_usd_balance', 'id'),
+    'idx_chain_eth': ('chain', 'contract_eth_balance', 'id'),
+    'idx_verified_usd': ('verified_code', 'contract_usd_balance', 'id'),
+    'idx_verified_eth': ('verified_code', 'contract_eth_balance', 'id'),
+    'idx_verified_id': ('verified_code', 'id'),
+    'idx_usd': ('contract_usd_balance', 'id'),
+    'idx_eth': ('contract_eth_balance', 'id'),
+}
+
+
+def add_column(cursor, table, column, definition):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() "
+                   "AND table_name = %s AND column_name = %s", (table, column))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                   "AND table_name = %s AND index_name = %s", (table, name))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"ALTER TABLE {table} ADD {'UNIQUE ' if unique else ''}INDEX {name} ({', '.join(columns)})")
+
+
+def add_filter_indexes(cursor):
+    for name, columns in FILTER_INDEXES.items():
+        add_index(cursor, 'processed_contract_info', name, columns)
+
+
+# Contracts enriched more than once before writes became upserts: the newest row of each
+# (chain, contract_address) is kept, with the distinct notes of all rows of the contract merged
+# into it one per line, so no user note is lost with the deleted rows
+DUPLICATE_CONTRACTS = """
+SELECT chain, contract_address, MAX(id) AS keep_id FROM processed_contract_info
+GROUP BY chain, contract_address HAVING COUNT(*) > 1
+"""
+
+
+def dedupe_processed_contracts(cursor):
+    # GROUP_CONCAT stops at 1024 bytes by default
+    cursor.execute("SET SESSION group_concat_max_len = 16777216")
+    cursor.execute("""
+        UPDATE processed_contract_info keep
+        JOIN (SELECT MAX(id) AS keep_id, GROUP_CONCAT(DISTINCT notes SEPARATOR '\\n') AS notes
+              FROM processed_contract_info GROUP BY chain, contract_address HAVING COUNT(*) > 1) d
+            ON keep.id = d.keep_id
+        SET keep.notes = d.notes
+        WHERE d.notes IS NOT NULL
+    """)
+    cursor.execute(f"""
+        DELETE h FROM contract_holdings h
+        JOIN processed_contract_info p ON h.contract_id = p.id
+        JOIN ({DUPLICATE_CONTRACTS}) d ON p.chain = d.chain AND p.contract_address = d.contract_address
+            AND p.id < d.keep_id
+    """)
+    cursor.execute(f"""
+        DELETE p FROM processed_contract_info p
+        JOIN ({DUPLICATE_CONTRACTS}) d ON p.chain = d.chain AND p.contract_address = d.contract_address
+            AND p.id < d.keep_id
+    """)
+    add_index(cursor, 'processed_contract_info', 'uq_chain_contract', ['chain', 'contract_address'], unique=True)
+
+
+MIGRATIONS = [
+    (1, "contract address tables", [CREATE_CONTRACT_ADDRESSES.format(table=config['table'])
+                                    for config in CHAINS.values()]),
+    (2, "processed_contract_info", [CREATE_PROCESSED_CONTRACT_INFO]),
+    (3, "token price cache", [CREATE_TOKEN_PRICES]),
+    (4, "content-addressed source store", [
+        CREATE_SOURCE_BLOBS,
+        lambda cursor: add_column(cursor, 'processed_contract_info', 'source_hash', 'CHAR(64) NULL'),
+    ]),
+    (5, "filter indexes of processed_contract_info", [add_filter_indexes]),
+    (6, "enrichment work queue", [CREATE_CONTRACT_QUEUE]),
+    # Walk of the balance refresh: one chain in id order
+    (7, "chain and id index of processed_contract_info", [
+        lambda cursor: add_index(cursor, 'processed_contract_info', 'idx_chain_id', ['chain', 'id']),
+    ]),
+    (8, "transfer log index", [CREATE_INDEXED_BALANCES, CREATE_TRANSFER_INDEX_PROGRESS]),
+    (9, "normalized token holdings", [CREATE_CONTRACT_HOLDINGS]),
+    (10, "unique chain and address of processed_contract_info", [dedupe_processed_contracts]),
+    # Filter indexes added to FILTER_INDEXES after migration 5; existing ones are skipped
+    (11, "chain and balance filter indexes", [add_filter_indexes]),
+]
+
+
+def migrate(connection, logger=None):
+    # Serialized with a named lock, so the scanner and the enricher can both run it at startup
+    with connection.cursor(pymysql.cursors.Cursor) as cursor:
+        cursor.execute("SELECT GET_LOCK('cryptodb_schema', 600)")
+        try:
+            cursor.execute(CREATE_MIGRATIONS_TABLE)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+
+            for version, description, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+                if logger:
+                    logger.info(f"Applying schema migration {version}: {description}")
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                               (version, description))
+                connection.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('cryptodb_schema')")
+
+
+def ensure_schema(connect, logger=None):
+    connection = connect()
+    try:
+        migrate(connection, logger)
+    finally:
+        connection.close()
+
+
+def main():
+    argparse.ArgumentParser(description="Create or update the database schema").parse_args()
+
+    connection = pymysql.connect(host=os.getenv("MYSQL_HOST"), user=os.getenv("MYSQL_NAME"),
+                                 password=os.getenv("MYSQL_PASSWORD"), db=os.getenv("MYSQL_DATABASE"),
+                                 charset='utf8mb4')
+    try:
+        migrate(connection)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version, description, applied_at FROM schema_migrations ORDER BY version")
+            for version, description, applied_at in cursor.fetchall():
+                print(f"{version:>3}  {applied_at}  {description}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
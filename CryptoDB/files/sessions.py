@@ -0,0 +1,39 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Keep-alive connections per upstream host and the defaults of every request made through them
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", 10)), float(os.getenv("HTTP_READ_TIMEOUT", 60)))
+RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    host = urlsplit(url).netloc
+    with sessions_lock:
+        if host not in sessions:
+            # Connection errors and 5xx answers are retried here; 429 is left to ratelimit
+            retry = Retry(total=RETRIES, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                          allowed_methods=None, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            sessions[host] = session
+        return sessions[host]
+
+
+def get(url, params=None, timeout=TIMEOUT, **kwargs):
+    return get_session(url).get(url, params=params, timeout=timeout, **kwargs)
+
+
+def post(url, json=None, timeout=TIMEOUT, **kwargs):
+    return get_session(url).post(url, json=json, timeout=timeout, **kwargs)
@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import pymysql
+
+from schema import migrate
+
+# Where contract sources are kept: "mysql" (source_blobs table) or "directory" (SOURCE_STORE_DIR)
+SOURCE_STORE = os.getenv("SOURCE_STORE", "mysql")
+SOURCE_STORE_DIR = os.getenv("SOURCE_STORE_DIR", "/root/files/sources")
+
+# Hashes known to be stored already, so repeated sources are not sent again
+KNOWN_HASHES_SIZE = int(os.getenv("SOURCE_STORE_KNOWN_HASHES", 100000))
+
+
+def source_hash(source_code):
+    return hashlib.sha256(source_code.encode('utf-8')).hexdigest()
+
+
+def compress(source_code):
+    return zlib.compress(source_code.encode('utf-8'), 9)
+
+
+def decompress(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+class KnownHashes:
+    def __init__(self, size):
+        self.size = size
+        self.hashes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, digest):
+        with self.lock:
+            if digest in self.hashes:
+                self.hashes.move_to_end(digest)
+                return True
+            return False
+
+    def add(self, digest):
+        with self.lock:
+            self.hashes[digest] = None
+            self.hashes.move_to_end(digest)
+            if len(self.hashes) > self.size:
+                self.hashes.popitem(last=False)
+
+
+class MySQLSourceStore:
+    # Compressed sources in the source_blobs table, one row per distinct source. Methods use the
+    # caller's connection; a blob is committed before any row can reference it.
+
+    def __init__(self):
+        self.known = KnownHashes(KNOWN_HASHES_SIZE)
+
+    def put(self, connection, source_code):
+        digest = source_hash(source_code)
+        if digest not in self.known:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT IGNORE INTO source_blobs (source_hash, size, compressed) VALUES (%s, %s, %s)",
+                               (digest, len(source_code), compress(source_code)))
+            connection.commit()
+            self.known.add(digest)
+        return digest
+
+    def get_many(self, connection, hashes):
+        hashes = list(dict.fromkeys(hashes))
+        if not hashes:
+            return {}
+        with connection.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(hashes))
+            cursor.execute(f"SELECT source_hash, compressed FROM source_blobs WHERE source_hash IN ({placeholders})",
+                           hashes)
+            return {row['source_hash']: decompress(row['compressed']) for row in cursor.fetchall()}
+
+
+class DirectorySourceStore:
+    # Compressed sources as files named by their hash, fanned out by the first two hex digits.
+    # The connection arguments only keep the interface of MySQLSourceStore.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.known = KnownHashes(KNOWN_HASHES_SIZE)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.zlib")
+
+    def put(self, connection, source_code):
+        digest = source_hash(source_code)
+        if digest in self.known:
+            return digest
+
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(compress(source_code))
+            os.replace(temp_path, path)
+        self.known.add(digest)
+        return digest
+
+    def get_many(self, connection, hashes):
+        sources = {}
+        for digest in dict.fromkeys(hashes):
+            try:
+                with open(self.path(digest), 'rb') as file:
+                    sources[digest] = decompress(file.read())
+            except FileNotFoundError:
+                pass
+        return sources
+
+
+def open_source_store():
+    if SOURCE_STORE == "directory":
+        return DirectorySourceStore(SOURCE_STORE_DIR)
+    return MySQLSourceStore()
+
+
+def migrate_inline_sources(connection, store, batch_size=500):
+    # Moves source_code kept inline in processed_contract_info into the store, batch by batch
+    moved = 0
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, source_code FROM processed_contract_info WHERE id > %s AND source_code IS NOT NULL "
+                           "AND source_hash IS NULL ORDER BY id LIMIT %s", (last_id, batch_size))
+            rows = cursor.fetchall()
+        if not rows:
+            return moved
+
+        updates = []
+        for row in rows:
+            if row['source_code']:
+                updates.append((store.put(connection, row['source_code']), row['id']))
+            else:
+                updates.append((None, row['id']))
+        with connection.cursor() as cursor:
+            cursor.executemany("UPDATE processed_contract_info SET source_hash = %s, source_code = NULL WHERE id = %s",
+                               updates)
+        connection.commit()
+
+        moved += len(rows)
+        last_id = rows[-1]['id']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move contract sources stored inline into the source store")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    connection = pymysql.connect(host=os.getenv("MYSQL_HOST"), user=os.getenv("MYSQL_NAME"),
+                                 password=os.getenv("MYSQL_PASSWORD"), db=os.getenv("MYSQL_DATABASE"),
+                                 charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor)
+    try:
+        migrate(connection)
+        store = open_source_store()
+        print(f"Moved {migrate_inline_sources(connection, store, args.batch_size)} sources")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
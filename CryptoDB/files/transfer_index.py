@@ -0,0 +1,180 @@
+import os
+
+import pymysql
+
+import balances
+import rpc
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+# Indexed balances are only trusted while the indexer is at most this many blocks behind the head
+MAX_LAG_BLOCKS = int(os.getenv("TRANSFER_INDEX_MAX_LAG", 1000))
+
+# Contracts per IN list when the rows touched by a block range are locked
+LOCK_CHUNK_SIZE = 1000
+
+
+def decode_transfers(logs):
+    # [(token, sender, recipient, value, block)] of ERC-20 Transfer logs, addresses lowercase.
+    # ERC-721 Transfer has the same topic with the token id indexed too; those logs have 4 topics.
+    transfers = []
+    for log in logs:
+        if log.get('removed') or len(log['topics']) != 3:
+            continue
+        transfers.append((
+            log['address'].lower(),
+            "0x" + log['topics'][1][-40:].lower(),
+            "0x" + log['topics'][2][-40:].lower(),
+            int(log['data'], 16) if log['data'] != "0x" else 0,
+            int(log['blockNumber'], 16),
+        ))
+    return transfers
+
+
+class TransferIndexer:
+    # Raw balances of the tracked tokens of one chain, kept in indexed_balances for the contracts
+    # seeded into it. A contract is seeded from balanceOf read at some block, and its rows only take
+    # Transfer logs of later blocks. The indexer's progress is stored in the transaction that applies
+    # a block range, so a range replayed after a crash is not counted twice.
+
+    def __init__(self, connect, chain, tracked_tokens):
+        self.connect = connect
+        self.chain = chain
+        # Lowercase address of every tracked token -> its address as configured
+        self.tokens = {address.lower(): address for address, _, _ in tracked_tokens}
+
+    def start(self, block):
+        # First block still to index; a chain indexed for the first time starts after block
+        connection = self.connect()
+        try:
+            with connection.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute("INSERT IGNORE INTO transfer_index_progress (chain, last_block) VALUES (%s, %s)",
+                               (self.chain, block))
+                cursor.execute("SELECT last_block FROM transfer_index_progress WHERE chain = %s", (self.chain,))
+                last_block = cursor.fetchone()[0]
+            connection.commit()
+            return last_block + 1
+        finally:
+            connection.close()
+
+    def apply(self, logs, start_block, end_block):
+        # Applies the Transfer logs of [start_block, end_block] and moves the progress past them
+        transfers = [transfer for transfer in decode_transfers(logs) if transfer[0] in self.tokens]
+        contracts = list({address for _, sender, recipient, _, _ in transfers for address in (sender, recipient)})
+
+        connection = self.connect()
+        try:
+            with connection.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute("SELECT last_block FROM transfer_index_progress WHERE chain = %s FOR UPDATE",
+                               (self.chain,))
+                last_block = cursor.fetchone()[0]
+                if last_block != start_block - 1:
+                    raise ValueError(f"Transfer index of {self.chain} is at block {last_block}, "
+                                     f"cannot apply blocks {start_block}-{end_block}")
+
+                rows = {}
+                for i in range(0, len(contracts), LOCK_CHUNK_SIZE):
+                    chunk = contracts[i:i + LOCK_CHUNK_SIZE]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cursor.execute(
+                        "SELECT contract_address, token, balance, last_block FROM indexed_balances "
+                        f"WHERE chain = %s AND contract_address IN ({placeholders}) FOR UPDATE",
+                        (self.chain, *chunk))
+                    for contract, token, balance, seeded_block in cursor.fetchall():
+                        rows[(contract.lower(), token.lower())] = [int(balance), seeded_block]
+
+                changed = set()
+                for token, sender, recipient, value, block in transfers:
+                    for key, delta in (((sender, token), -value), ((recipient, token), value)):
+                        row = rows.get(key)
+                        if row and block > row[1]:
+                            row[0] += delta
+                            changed.add(key)
+
+                if changed:
+                    cursor.executemany(
+                        "UPDATE indexed_balances SET balance = %s, last_block = %s "
+                        "WHERE chain = %s AND contract_address = %s AND token = %s",
+                        [(rows[key][0], end_block, self.chain, *key) for key in changed])
+                cursor.execute("UPDATE transfer_index_progress SET last_block = %s WHERE chain = %s",
+                               (end_block, self.chain))
+            connection.commit()
+            return len(changed)
+        finally:
+            connection.close()
+
+    def seed(self, block, token_balances):
+        # Stores {contract: {token: raw balance}} read at block. Refused when the indexer is not
+        # running for the chain or has already applied blocks after it, whose transfers would be lost.
+        if not token_balances:
+            return False
+        connection = self.connect()
+        try:
+            with connection.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute("SELECT last_block FROM transfer_index_progress WHERE chain = %s FOR SHARE",
+                               (self.chain,))
+                progress = cursor.fetchone()
+                if progress is None or progress[0] > block:
+                    connection.rollback()
+                    return False
+
+                cursor.executemany(
+                    "INSERT IGNORE INTO indexed_balances (chain, contract_address, token, balance, last_block) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(self.chain, contract.lower(), token.lower(), balance, block)
+                     for contract, balances_by_token in token_balances.items()
+                     for token, balance in balances_by_token.items()])
+            connection.commit()
+            return True
+        finally:
+            connection.close()
+
+    def lookup(self, contracts, block):
+        # {contract: {token: raw balance}} for the given contracts that have a row for every tracked
+        # token, keyed as given; nothing while the indexer lags more than MAX_LAG_BLOCKS behind block
+        if not contracts:
+            return {}
+        by_lower = {contract.lower(): contract for contract in contracts}
+        connection = self.connect()
+        try:
+            with connection.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute("SELECT last_block FROM transfer_index_progress WHERE chain = %s", (self.chain,))
+                progress = cursor.fetchone()
+                if progress is None or progress[0] < block - MAX_LAG_BLOCKS:
+                    return {}
+
+                placeholders = ", ".join(["%s"] * len(by_lower))
+                cursor.execute(
+                    "SELECT contract_address, token, balance FROM indexed_balances "
+                    f"WHERE chain = %s AND contract_address IN ({placeholders})",
+                    (self.chain, *by_lower))
+                found = {}
+                for contract, token, balance in cursor.fetchall():
+                    if token.lower() in self.tokens:
+                        found.setdefault(by_lower[contract.lower()], {})[self.tokens[token.lower()]] = int(balance)
+                return {contract: held for contract, held in found.items() if len(held) == len(self.tokens)}
+        finally:
+            connection.close()
+
+
+def get_balances(indexer, confirmations, url, contracts, tokens):
+    # balances.get_balances with the token balances taken from the index for contracts it holds.
+    # Only their native balances are read from the node; the other contracts are read in full at
+    # the same block and seeded into the index. That block stays confirmations behind the head, as
+    # the indexer does: a seed read on a block that is later reorged away would never be corrected.
+    block = rpc.get_block_number(url) - confirmations
+    indexed = indexer.lookup(contracts, block)
+
+    results = {}
+    if indexed:
+        natives = balances.get_balances(url, list(indexed), [], block)
+        results = {contract: (natives[contract][0], indexed[contract]) for contract in indexed}
+
+    missing = [contract for contract in contracts if contract not in indexed]
+    if missing:
+        read = balances.get_balances(url, missing, tokens, block)
+        indexer.seed(block, {contract: token_balances for contract, (_, token_balances) in read.items()
+                             if None not in token_balances.values()})
+        results.update(read)
+    return results
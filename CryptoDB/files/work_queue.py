@@ -0,0 +1,81 @@
+import os
+import socket
+import uuid
+
+# Contracts enter contract_queue once per chain: the scanner pushes them in the same transaction
+# that stores them, and a contract already queued (or done) is ignored by the unique key.
+ENQUEUE_QUERY = "INSERT IGNORE INTO contract_queue (chain, address) VALUES (%s, %s)"
+
+PENDING = 0
+DONE = 1
+
+
+class WorkQueue:
+    # Contracts of one chain waiting for enrichment. Items are claimed in batches with
+    # SELECT ... FOR UPDATE SKIP LOCKED, so several enrichers can share a chain, and leased: an
+    # item not acked before its lease ends (its enricher died) is handed out again. Items claimed
+    # max_attempts times without an ack stay pending in the table for inspection.
+
+    def __init__(self, connect, chain, lease_seconds, max_attempts):
+        self.connect = connect
+        self.chain = chain
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def claim(self, limit):
+        # Returns [(id, address)] leased to this worker
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, address FROM contract_queue WHERE chain = %s AND state = %s AND attempts < %s "
+                    "AND (lease_until IS NULL OR lease_until < NOW()) ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                    (self.chain, PENDING, self.max_attempts, limit))
+                items = [(row['id'], row['address']) for row in cursor.fetchall()]
+
+                if items:
+                    placeholders = ", ".join(["%s"] * len(items))
+                    cursor.execute(
+                        "UPDATE contract_queue SET lease_until = NOW() + INTERVAL %s SECOND, claimed_by = %s, "
+                        f"attempts = attempts + 1 WHERE id IN ({placeholders})",
+                        (self.lease_seconds, self.worker, *[item_id for item_id, _ in items]))
+            connection.commit()
+            return items
+        finally:
+            connection.close()
+
+    def ack(self, ids):
+        # Only items still leased to this worker: one whose lease ran out may belong to another now
+        self._update(ids, "state = %s, lease_until = NULL", (DONE,))
+
+    def retry(self, ids, delay):
+        self._update(ids, "lease_until = NOW() + INTERVAL %s SECOND", (delay,))
+
+    def _update(self, ids, assignments, params):
+        if not ids:
+            return
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(
+                    f"UPDATE contract_queue SET {assignments} WHERE id IN ({placeholders}) AND claimed_by = %s",
+                    (*params, *ids, self.worker))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def seed(self, table, since):
+        # Queues the contracts of table found since the given time, for databases filled before the queue
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT IGNORE INTO contract_queue (chain, address) "
+                               f"SELECT %s, address FROM {table} WHERE created_at >= %s ORDER BY created_at",
+                               (self.chain, since))
+                seeded = cursor.rowcount
+            connection.commit()
+            return seeded
+        finally:
+            connection.close()
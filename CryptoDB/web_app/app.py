@@ -1,10 +1,19 @@
-from flask import Flask, render_template, request, jsonify
-from flask.helpers import send_file
+from flask import Flask, Response, render_template, request, jsonify
 import pymysql.cursors
+import csv
 import os
+import sys
 import zipfile
 import io
 
+from db_pool import ConnectionPool, PoolTimeout
+from filters import FilterError, export_query, normalize_args, page_query, split_page
+from result_cache import ResultCache
+
+# Modules shared with the scanner and enricher
+sys.path.append(os.getenv('CRYPTODB_FILES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files')))
+from source_store import open_source_store, source_hash
+
 
 app = Flask(__name__)
 
@@ -18,21 +27,86 @@ db_config = {
     'cursorclass': pymysql.cursors.DictCursor,
 }
 
-@app.route('/')
-def index():
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            # SQL Without filters
+# Connections shared by all routes
+db_pool = ConnectionPool(
+    db_config,
+    max_size=int(os.getenv('DB_POOL_SIZE', 10)),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+    ping_interval=float(os.getenv('DB_POOL_PING_INTERVAL', 30)),
+    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+)
+
+source_store = open_source_store()
+
+# Pages of the table by filter arguments; the enricher touches the stamp file when it adds rows
+result_cache = ResultCache(
+    ttl=float(os.getenv('RESULT_CACHE_TTL', 30)),
+    size=int(os.getenv('RESULT_CACHE_SIZE', 1000)),
+    stamp_file=os.getenv('RESULT_CACHE_STAMP', '/root/files/processed_contract_info.stamp'),
+)
+
+# Rows per page of a ZIP export. A pooled connection is held only while a page and its sources
+# are read, never while the client downloads, so slow exports do not starve the other routes.
+ZIP_FETCH_ROWS = int(os.getenv('ZIP_FETCH_ROWS', 100))
+
+
+class ZipStream(io.RawIOBase):
+    # Unseekable file for zipfile: collects the written bytes until the response takes them
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def load_page(args):
+    # Rows and next-page cursor of one page, from the result cache when it has them
+    args = normalize_args(args)
+
+    def load():
+        sql, params, sort = page_query(args)
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, tuple(params))
+                return split_page(cursor.fetchall(), sort)
+
+    return result_cache.get_or_load(tuple(sorted(args.items())), load)
+
 
-            sql = f"SELECT id, contract_address, verified_code, tokens_balances, tokens_list, contract_name, contract_usd_balance, contract_eth_balance, notes, chain FROM processed_contract_info LIMIT 50"
-            cursor.execute(sql)
+def load_export_page(sql, params, last_id, exported):
+    # Rows of an export after last_id and the sources the store holds for them, read on one
+    # buffered connection that goes back to the pool before the page is compressed
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (*params, last_id, ZIP_FETCH_ROWS))
             result = cursor.fetchall()
-            
-    finally:
-        conn.close()
 
-    return render_template('index.html', data=result)
+        # Rows written before the source store have their source inline
+        for item in result:
+            if item['source_hash'] is None and item['source_code']:
+                item['source_hash'] = source_hash(item['source_code'])
+        sources = source_store.get_many(
+            conn, [item['source_hash'] for item in result if item['source_code'] is None
+                   and item['source_hash'] is not None and item['source_hash'] not in exported])
+    return result, sources
+
+
+@app.route('/')
+def index():
+    # Page without filters
+    result, next_cursor = load_page({})
+
+    return render_template('index.html', data=result, next_cursor=next_cursor)
 
 @app.route('/get_text_data/<chain>')
 def get_text_data(chain):
@@ -47,128 +121,60 @@ def get_text_data(chain):
 
 @app.route('/apply_filters', methods=['GET'])
 def apply_filters():
-    verified_code = request.args.get('verified_code')
-    eth_balance_operator = request.args.get('eth_balance_operator')
-    eth_balance_value = request.args.get('eth_balance_value')
-    usd_balance_operator = request.args.get('usd_balance_operator')
-    usd_balance_value = request.args.get('usd_balance_value')
-    chain_name = request.args.get('chain_name')
-    
-    page = int(request.args.get('page', 1))
-    records_per_page = 50
-
-    conn = pymysql.connect(**db_config)
-    try:
-        with conn.cursor() as cursor:
-            sql = "SELECT id, contract_address, verified_code, tokens_balances, tokens_list, contract_name, contract_usd_balance, contract_eth_balance, notes, chain FROM processed_contract_info WHERE 1"
-
-            params = []
-
-            if verified_code != 'all':
-                sql += " AND verified_code = %s"
-                params.append(int(verified_code))
-
-            if eth_balance_operator and eth_balance_value:
-                if eth_balance_operator == 'ge':
-                    sql += " AND contract_eth_balance >= %s"
-                elif eth_balance_operator == 'le':
-                    sql += " AND contract_eth_balance <= %s"
-                else:
-                    sql += " AND contract_eth_balance = %s"
-                params.append(float(eth_balance_value))
-                    
-            if usd_balance_operator and usd_balance_value:
-                if usd_balance_operator == 'ge':
-                    sql += " AND contract_usd_balance >= %s"
-                elif usd_balance_operator == 'le':
-                    sql += " AND contract_usd_balance <= %s"
-                else:
-                    sql += " AND contract_usd_balance = %s"
-                params.append(float(usd_balance_value))
-                
-            if chain_name != 'all':
-                sql += " AND chain = %s"
-                params.append(chain_name)
-                
-            start_index = (page - 1) * records_per_page
-            
-            sql += f" LIMIT {start_index}, {records_per_page}"
-
-            cursor.execute(sql, tuple(params))
-            result = cursor.fetchall()
-    finally:
-        conn.close()
+    result, next_cursor = load_page(request.args)
 
-    return jsonify(result)
+    return jsonify({'rows': result, 'next_cursor': next_cursor})
 
 @app.route('/download_zip', methods=['GET'])
 def download_zip():
-    conn = pymysql.connect(**db_config)
-    verified_code = request.args.get('verified_code')
-    eth_balance_operator = request.args.get('eth_balance_operator')
-    eth_balance_value = request.args.get('eth_balance_value')
-    usd_balance_operator = request.args.get('usd_balance_operator')
-    usd_balance_value = request.args.get('usd_balance_value')
-    chain_name = request.args.get('chain_name')
-    
-    try:
-        with conn.cursor() as cursor:
-            sql = "SELECT source_code, contract_address FROM processed_contract_info WHERE 1"
-            
-            params = []
-
-            if verified_code != 'all':
-                sql += " AND verified_code = %s"
-                params.append(int(verified_code))
-
-            if eth_balance_operator and eth_balance_value:
-                if eth_balance_operator == 'ge':
-                    sql += " AND contract_eth_balance >= %s"
-                elif eth_balance_operator == 'le':
-                    sql += " AND contract_eth_balance <= %s"
-                else:
-                    sql += " AND contract_eth_balance = %s"
-                params.append(float(eth_balance_value))
-                    
-            if usd_balance_operator and usd_balance_value:
-                if usd_balance_operator == 'ge':
-                    sql += " AND contract_usd_balance >= %s"
-                elif usd_balance_operator == 'le':
-                    sql += " AND contract_usd_balance <= %s"
-                else:
-                    sql += " AND contract_usd_balance = %s"
-                params.append(float(usd_balance_value))
-                
-            if chain_name != 'all':
-                sql += " AND chain = %s"
-                params.append(chain_name)
-
-            cursor.execute(sql, tuple(params))
-            result = cursor.fetchall()
+    sql, params = export_query(request.args)
+
+    def generate():
+        # Each distinct source is written once; contracts sharing it are listed in duplicates.csv
+        exported = {}
+        duplicates = io.StringIO()
+        duplicates_csv = csv.writer(duplicates)
+
+        stream = ZipStream()
+        last_id = 0
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            while True:
+                result, sources = load_export_page(sql, params, last_id, exported)
+                if not result:
+                    break
+                last_id = result[-1]['id']
 
-            # Создаем временный буфер в памяти
-            zip_buffer = io.BytesIO()
-
-            # Создаем Zip-архив
-            with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zip_file:
                 for item in result:
                     contract_address = item['contract_address']
-                    contract_code = item['source_code']
+                    file_name = f"{contract_address}.sol"
+
+                    # Contracts without verified source have nothing to export
+                    if item['source_hash'] is None:
+                        continue
+                    if item['source_hash'] in exported:
+                        duplicates_csv.writerow([file_name, exported[item['source_hash']]])
+                        continue
+                    contract_code = item['source_code'] if item['source_code'] is not None else sources.get(item['source_hash'])
+                    if contract_code is None:
+                        continue
+                    exported[item['source_hash']] = file_name
 
                     # Добавляем файл в архив
-                    zip_file.writestr(f"{contract_address}.sol", contract_code)
+                    zip_file.writestr(file_name, contract_code)
+
+                yield stream.take()
 
-            zip_buffer.seek(0)
+            if duplicates.tell():
+                zip_file.writestr('duplicates.csv', 'file,same_source_as\n' + duplicates.getvalue())
 
-    finally:
-        conn.close()
+        # Central directory
+        yield stream.take()
 
-    # Отправим файл пользователю для скачивания
-    return send_file(
-        zip_buffer,
+    # Отправляем архив по частям, пока он пишется
+    return Response(
+        generate(),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='contracts.zip'
+        headers={'Content-Disposition': 'attachment; filename=contracts.zip'}
     )
 
 
@@ -177,14 +183,12 @@ def add_note():
     contract_id = request.form['contract_id']
     note_text = request.form['note_text']
 
-    conn = pymysql.connect(**db_config)
-    try:
+    with db_pool.connection() as conn:
         with conn.cursor() as cursor:
             sql = "UPDATE processed_contract_info SET notes = %s WHERE id = %s"
             cursor.execute(sql, (note_text, contract_id))
             conn.commit()
-    finally:
-        conn.close()
+    result_cache.invalidate()
 
     return 'Note added successfully'
 
@@ -192,17 +196,31 @@ def add_note():
 def delete_note():
     contract_id = request.form['contract_id']
 
-    conn = pymysql.connect(**db_config)
-    try:
+    with db_pool.connection() as conn:
         with conn.cursor() as cursor:
             sql = "UPDATE processed_contract_info SET notes = NULL WHERE id = %s"
             cursor.execute(sql, (contract_id,))
             conn.commit()
-    finally:
-        conn.close()
+    result_cache.invalidate()
 
     return 'Note deleted successfully'
 
+@app.errorhandler(FilterError)
+def filter_error(error):
+    return str(error), 400
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(error):
+    return str(error), 503
+
+@app.route('/pool_stats')
+def pool_stats():
+    return jsonify(db_pool.metrics())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(result_cache.metrics())
+
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
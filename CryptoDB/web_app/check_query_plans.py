@@ -0,0 +1,90 @@
+import argparse
+import itertools
+import sys
+
+from app import db_pool
+from chains import CHAINS
+from filters import SORT_COLUMNS, encode_cursor, page_query
+
+# Runs EXPLAIN for every filter combination the dashboard can send and fails if the page query
+# of any of them reads processed_contract_info or contract_holdings without an index, or sorts
+# rows it could have read in keyset order. Plans depend on table statistics, so run it against a
+# database with production-like data after changing filters.py or the indexes in files/schema.py.
+
+# Share of the table a page may sort when no index can give its order (a balance range filtered
+# on another column than the sort, or a token filter)
+MAX_SORTED_FRACTION = 0.5
+
+
+def filter_combinations():
+    chains = ['all', CHAINS[next(iter(CHAINS))]['label']]
+    verified = ['all', '1']
+    eth_filters = [{}, {'eth_balance_operator': 'ge', 'eth_balance_value': '1000'}]
+    usd_filters = [{}, {'usd_balance_operator': 'ge', 'usd_balance_value': '1000000'}]
+    token_filters = [{}, {'token_symbol': 'USDT', 'token_usd_value': '100000'}]
+
+    for chain, verified_code, eth_filter, usd_filter, token_filter, sort, paged in itertools.product(
+            chains, verified, eth_filters, usd_filters, token_filters, SORT_COLUMNS, (False, True)):
+        args = {'chain_name': chain, 'verified_code': verified_code, 'sort': sort,
+                **eth_filter, **usd_filter, **token_filter}
+        if paged:
+            column = SORT_COLUMNS[sort]
+            args['cursor'] = encode_cursor(sort, {'id': 1000, **({column: 1.0} if column else {})})
+        yield args
+
+
+def keyset_ordered(args):
+    # Whether an index can give the rows of the page in their sort order: every range filter is
+    # on the sort column, and no token filter picks ids from contract_holdings
+    column = SORT_COLUMNS[args.get('sort', 'id')]
+    ranges = {f'contract_{balance}_balance' for balance in ('eth', 'usd') if args.get(f'{balance}_balance_operator')}
+    return not args.get('token_symbol') and ranges <= {column}
+
+
+def check_plan(cursor, args, table_rows):
+    # Problems of the plan, empty when every read of processed_contract_info and contract_holdings
+    # uses an index and the ids of the page are sorted only when no index has their order
+    sql, params, _ = page_query(args)
+    cursor.execute(f"EXPLAIN {sql}", tuple(params))
+    problems = []
+    for row in cursor.fetchall():
+        if row['table'] not in ('processed_contract_info', 'p', 'contract_holdings', 'h'):
+            continue
+        if row['type'] == 'ALL' or row['key'] is None:
+            problems.append(f"full scan of {row['table']} ({row['Extra'] or 'no index'})")
+        # The page's ids are read from processed_contract_info unaliased; p only joins them
+        elif row['table'] == 'processed_contract_info' and 'Using filesort' in (row['Extra'] or ''):
+            if keyset_ordered(args):
+                problems.append(f"filesort of {row['rows']} rows instead of reading {row['key']} in order")
+            elif table_rows and row['rows'] >= MAX_SORTED_FRACTION * table_rows:
+                problems.append(f"filesort of {row['rows']} rows, about the whole table")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every dashboard filter path uses an index")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print the plan of every combination")
+    args = parser.parse_args()
+
+    failures = 0
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT TABLE_ROWS FROM information_schema.tables WHERE table_schema = DATABASE() "
+                           "AND table_name = 'processed_contract_info'")
+            table_rows = cursor.fetchone()['TABLE_ROWS'] or 0
+            for filters in filter_combinations():
+                problems = check_plan(cursor, filters, table_rows)
+                label = ", ".join(f"{key}={value}" for key, value in filters.items() if key != 'cursor')
+                label += ", next page" if 'cursor' in filters else ", first page"
+                if problems:
+                    failures += 1
+                    print(f"FAIL {label}: {'; '.join(problems)}")
+                elif args.verbose:
+                    print(f"ok   {label}")
+
+    print(f"{failures} filter paths without an index or with an avoidable sort")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
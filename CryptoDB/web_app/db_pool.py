@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Bounded pool of pymysql connections shared by all routes. Connections idle for longer than
+    # ping_interval are pinged before use, connections older than max_lifetime are replaced, and a
+    # connection whose query failed is closed instead of going back to the pool.
+
+    def __init__(self, config, max_size=10, timeout=5, ping_interval=30, max_lifetime=3600):
+        # Autocommit, so a pooled connection never keeps an old read snapshot between requests
+        self.config = dict(config, autocommit=True)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.max_lifetime = max_lifetime
+
+        self.idle = []  # (connection, created_at, last_used)
+        self.size = 0
+        self.condition = threading.Condition()
+        self.stats = {'created': 0, 'checkouts': 0, 'discarded': 0, 'ping_failures': 0, 'timeouts': 0,
+                      'wait_seconds': 0.0}
+
+    def acquire(self):
+        started = time.monotonic()
+        while True:
+            entry = self._take(started)
+            if entry is None:
+                return self._create(started)
+
+            connection, created_at, last_used = entry
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self._discard(connection)
+                continue
+            if now - last_used > self.ping_interval:
+                try:
+                    connection.ping(reconnect=False)
+                except pymysql.Error:
+                    self.stats['ping_failures'] += 1
+                    self._discard(connection)
+                    continue
+
+            self._checked_out(connection, created_at, started)
+            return connection
+
+    def _take(self, started):
+        # An idle connection, or None when a new one may be opened
+        with self.condition:
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None
+
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available within {self.timeout} s")
+                self.condition.wait(remaining)
+
+    def _create(self, started):
+        try:
+            connection = pymysql.connect(**self.config)
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.stats['created'] += 1
+        self._checked_out(connection, time.monotonic(), started)
+        return connection
+
+    def _checked_out(self, connection, created_at, started):
+        connection._pool_created_at = created_at
+        with self.condition:
+            self.stats['checkouts'] += 1
+            self.stats['wait_seconds'] += time.monotonic() - started
+
+    def release(self, connection):
+        with self.condition:
+            self.idle.append((connection, connection._pool_created_at, time.monotonic()))
+            self.condition.notify()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except pymysql.Error:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.stats['discarded'] += 1
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError, GeneratorExit):
+            # GeneratorExit: a streamed response was abandoned, possibly with unread rows pending
+            self._discard(connection)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def metrics(self):
+        with self.condition:
+            return dict(self.stats, size=self.size, idle=len(self.idle), in_use=self.size - len(self.idle),
+                        max_size=self.max_size)
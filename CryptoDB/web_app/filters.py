@@ -0,0 +1,169 @@
+import base64
+import json
+
+# SQL for the filters of the dashboard, shared by the table pages and the ZIP export. The indexes
+# these queries rely on are defined in files/schema.py (FILTER_INDEXES) and checked by
+# check_query_plans.py.
+
+RECORDS_PER_PAGE = 50
+
+LIST_COLUMNS = ("id", "contract_address", "verified_code", "tokens_balances", "tokens_list", "contract_name",
+                "contract_usd_balance", "contract_eth_balance", "notes", "chain")
+
+# Orderings the table can be paged in. Pages are read with keyset pagination on (sort column, id):
+# plain views ascend by id, balance views descend by balance with id breaking ties, so every page
+# is an index range scan and rows with equal balances never move between pages.
+SORT_COLUMNS = {
+    'id': None,
+    'usd_balance': 'contract_usd_balance',
+    'eth_balance': 'contract_eth_balance',
+}
+
+OPERATORS = {'ge': '>=', 'le': '<=', 'eq': '='}
+
+# Tokens of a page are listed from contract_holdings, largest first; rows enriched before that
+# table existed keep their stored strings
+HOLDINGS_COLUMNS = {
+    'tokens_list': "h.symbol",
+    'tokens_balances': "ROUND(h.balance)",
+}
+
+
+class FilterError(ValueError):
+    pass
+
+
+def normalize_args(args):
+    # The arguments that affect the query, without defaults and unused ones, so that equivalent
+    # requests are equal (keys of the result cache)
+    normalized = {}
+    for name in ('verified_code', 'chain_name'):
+        if args.get(name) and args[name] != 'all':
+            normalized[name] = args[name]
+
+    for balance in ('eth', 'usd'):
+        operator = args.get(f'{balance}_balance_operator')
+        value = args.get(f'{balance}_balance_value')
+        if operator and value:
+            normalized[f'{balance}_balance_operator'] = operator if operator in OPERATORS else 'eq'
+            normalized[f'{balance}_balance_value'] = value
+
+    if args.get('token_symbol'):
+        normalized['token_symbol'] = args['token_symbol'].strip()
+        normalized['token_usd_value'] = args.get('token_usd_value') or '0'
+
+    if args.get('sort', 'id') != 'id':
+        normalized['sort'] = args['sort']
+    if args.get('cursor'):
+        normalized['cursor'] = args['cursor']
+    return normalized
+
+
+def build_filters(args):
+    # WHERE conditions for the request arguments of /apply_filters and /download_zip
+    verified_code = args.get('verified_code', 'all')
+    eth_balance_operator = args.get('eth_balance_operator')
+    eth_balance_value = args.get('eth_balance_value')
+    usd_balance_operator = args.get('usd_balance_operator')
+    usd_balance_value = args.get('usd_balance_value')
+    chain_name = args.get('chain_name', 'all')
+    token_symbol = args.get('token_symbol')
+
+    sql = "WHERE 1"
+    params = []
+
+    try:
+        if verified_code and verified_code != 'all':
+            sql += " AND verified_code = %s"
+            params.append(int(verified_code))
+
+        if eth_balance_operator and eth_balance_value:
+            sql += f" AND contract_eth_balance {OPERATORS.get(eth_balance_operator, '=')} %s"
+            params.append(float(eth_balance_value))
+
+        if usd_balance_operator and usd_balance_value:
+            sql += f" AND contract_usd_balance {OPERATORS.get(usd_balance_operator, '=')} %s"
+            params.append(float(usd_balance_value))
+
+        # Contracts holding at least token_usd_value USD of the token, found in idx_symbol_usd
+        if token_symbol:
+            sql += " AND id IN (SELECT contract_id FROM contract_holdings WHERE symbol = %s AND usd_value >= %s)"
+            params.extend([token_symbol.strip(), float(args.get('token_usd_value') or 0)])
+    except ValueError:
+        raise FilterError("Invalid filter value")
+
+    if chain_name and chain_name != 'all':
+        sql += " AND chain = %s"
+        params.append(chain_name)
+
+    return sql, params
+
+
+def encode_cursor(sort, row):
+    column = SORT_COLUMNS[sort]
+    key = [sort, row[column] if column else None, row['id']]
+    return base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode()
+
+
+def decode_cursor(sort, cursor):
+    try:
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise FilterError("Invalid cursor")
+    if cursor_sort != sort:
+        raise FilterError("Cursor belongs to another sort order")
+    return value, last_id
+
+
+def list_column(name):
+    if name not in HOLDINGS_COLUMNS:
+        return f"p.{name}"
+    listed = (f"SELECT GROUP_CONCAT({HOLDINGS_COLUMNS[name]} ORDER BY h.usd_value DESC, h.token SEPARATOR ';') "
+              f"FROM contract_holdings h WHERE h.contract_id = p.id")
+    return f"COALESCE(({listed}), p.{name}, '') AS {name}"
+
+
+def page_query(args):
+    # Returns the SQL and parameters of one page of the table, and the sort order it is read in.
+    # The page's ids are found in a subquery that only touches a filter index; the full rows are
+    # then read by primary key for just those ids. One extra row tells whether a next page exists.
+    sort = args.get('sort', 'id')
+    if sort not in SORT_COLUMNS:
+        raise FilterError("Unknown sort order")
+    column = SORT_COLUMNS[sort]
+
+    where, params = build_filters(args)
+    cursor = args.get('cursor')
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        if column is None:
+            where += " AND id > %s"
+            params.append(last_id)
+        else:
+            where += f" AND ({column} < %s OR ({column} = %s AND id < %s))"
+            params.extend([value, value, last_id])
+
+    if column is None:
+        order = "ORDER BY {prefix}id"
+    else:
+        order = f"ORDER BY {{prefix}}{column} DESC, {{prefix}}id DESC"
+
+    ids_sql = f"SELECT id FROM processed_contract_info {where} {order.format(prefix='')} LIMIT {RECORDS_PER_PAGE + 1}"
+    sql = (f"SELECT {', '.join(list_column(name) for name in LIST_COLUMNS)} FROM processed_contract_info p "
+           f"JOIN ({ids_sql}) page ON page.id = p.id {order.format(prefix='p.')}")
+    return sql, params, sort
+
+
+def split_page(rows, sort):
+    if len(rows) > RECORDS_PER_PAGE:
+        return rows[:RECORDS_PER_PAGE], encode_cursor(sort, rows[RECORDS_PER_PAGE - 1])
+    return rows, None
+
+
+def export_query(args):
+    # SQL of one page of the ZIP export in id order; the caller appends the last id it has read
+    # and the page size to the parameters
+    where, params = build_filters(args)
+    sql = (f"SELECT id, source_hash, source_code, contract_address FROM processed_contract_info {where} "
+           f"AND id > %s ORDER BY id LIMIT %s")
+    return sql, params
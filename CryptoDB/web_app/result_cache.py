@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    # Query results of the dashboard keyed by normalized filter arguments, kept for ttl seconds.
+    # Whoever changes processed_contract_info (the enricher, or invalidate() for notes) touches
+    # stamp_file, and a newer stamp clears the cache of every web app process on its next lookup.
+
+    def __init__(self, ttl, size, stamp_file):
+        self.ttl = ttl
+        self.size = size
+        self.stamp_file = stamp_file
+        self.stamp = self.read_stamp()
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, so a result loaded before it is not stored after it
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def read_stamp(self):
+        try:
+            return os.stat(self.stamp_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, key):
+        stamp = self.read_stamp()
+        now = time.monotonic()
+        with self.lock:
+            if stamp != self.stamp:
+                self.stamp = stamp
+                self._clear()
+
+            entry = self.entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get_or_load(self, key, load):
+        value = self.get(key)
+        if value is None:
+            generation = self.generation
+            value = load()
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self):
+        try:
+            with open(self.stamp_file, 'a'):
+                pass
+            os.utime(self.stamp_file)
+        except OSError:
+            pass
+        with self.lock:
+            self.stamp = self.read_stamp()
+            self._clear()
+
+    def _clear(self):
+        self.entries.clear()
+        self.generation += 1
+        self.stats['invalidations'] += 1
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), ttl=self.ttl)